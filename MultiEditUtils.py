@@ -1,65 +1,345 @@
 import sublime, sublime_plugin
 import re
-from collections import namedtuple
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
 
+from . import lib
+
+
+_executor = None
+
+
+def getExecutor():
+
+  # the pool is created on first use, so that loading the plugin stays cheap
+  global _executor
+  if _executor is None:
+    from concurrent.futures import ThreadPoolExecutor
+    _executor = ThreadPoolExecutor(max_workers=4)
+
+  return _executor
+
+
+
+class ViewSnapshot:
+
+  # The text of a view at a change count, see processViews.
+  def __init__(self, view):
+
+    self.view = view
+    self.changeCount = view.change_count()
+    self.text = view.substr(sublime.Region(0, view.size()))
+    self.future = None
+    self.result = None
+
+
+  def isCurrent(self):
+
+    # whether the view wasn't modified since the snapshot was taken
+    return self.view.is_valid() and self.view.change_count() == self.changeCount
+
+
+  def takeResult(self):
+
+    # the result of the work on the snapshot, the text is released
+    self.result = self.future.result()
+    self.text = self.future = None
+    return self.result
+
+
+  def label(self):
+
+    fileName = self.view.file_name()
+    if fileName:
+      return fileName
+
+    return self.view.name() or "untitled"
+
+
+
+def processViews(views, work, onDone):
+
+  # Take a snapshot of every view on the main thread and run work(snapshot) for
+  # the snapshots in the pool. Once all of them are done, onDone(snapshots) is
+  # called on the main thread. Returns the snapshots.
+  import threading
+
+  executor = getExecutor()
+  snapshots = [ViewSnapshot(view) for view in views]
+  pending = [len(snapshots)]
+  lock = threading.Lock()
+
+  def onFinished(future):
+    with lock:
+      pending[0] -= 1
+      isLast = pending[0] == 0
+    if isLast:
+      sublime.set_timeout(lambda: onDone(snapshots), 0)
+
+  if not snapshots:
+    sublime.set_timeout(lambda: onDone(snapshots), 0)
+
+  for snapshot in snapshots:
+    snapshot.future = executor.submit(work, snapshot)
+  for snapshot in snapshots:
+    snapshot.future.add_done_callback(onFinished)
+
+  return snapshots
+
+
+def bufferViews(window):
+
+  # One view per buffer of the window, clones share their buffer. The active
+  # view stands in for its buffer, the other ones keep their order.
+  activeView = window.active_view()
+  views = OrderedDict()
+  for view in window.views():
+    bufferID = view.buffer_id()
+    if bufferID not in views or view == activeView:
+      views[bufferID] = view
+
+  return list(views.values())
+
+
+def plugin_loaded():
+
+  lib.reloadModules()
+  lib.load("settings").addListener(lib.instrumentAll)
+  lib.instrumentAll()
+
+
+def plugin_unloaded():
+
+  for name in ["profiling", "settings"]:
+    module = lib.loaded(name)
+    if module is not None:
+      module.unload()
+
+  selectionTrace = lib.loaded("selection_trace")
+  if selectionTrace is not None:
+    selectionTrace.flush()
+
+  global _executor
+  if _executor is not None:
+    _executor.shutdown(wait=False)
+    _executor = None
+
+
+def selectNeedles(view, expand):
+
+  # filter selections in order to exclude duplicates since it can hang
+  # Sublime if search is performed on dozens of selections, this doesn't
+  # happen with built-in command because it works on a single selection
+  initial = [sel for sel in view.sel()]
+  regions, substrings, seen = [], [], set()
+  for region in view.sel():
+    if expand and region.empty():
+      # if expanding substring will be the word
+      region = view.word(region.a)
+      # add the region since nothing is selected yet
+      view.sel().add(region)
+    # filter by substring (word or not)
+    substr = view.substr(region)
+    if substr and substr not in seen:
+      regions.append(region)
+      substrings.append(substr)
+      seen.add(substr)
+  view.sel().clear()
+  if regions:
+    for region in regions:
+      view.sel().add(region)
+  else:
+    view.window().status_message("Multi Find All: nothing selected")
+    for sel in initial:
+      view.sel().add(sel)
+
+  return substrings
+
+
+@lib.instrument
 class MultiFindAllCommand(sublime_plugin.TextCommand):
 
   def run(self, edit, case=True, word=False, ignore_comments=False, expand=True):
 
     view = self.view
-    newRegions = []
-
-    # filter selections in order to exclude duplicates since it can hang
-    # Sublime if search is performed on dozens of selections, this doesn't
-    # happen with built-in command because it works on a single selection
-    initial = [sel for sel in view.sel()]
-    regions, substrings = [], []
-    for region in view.sel():
-      if expand and region.empty():
-        # if expanding substring will be the word
-        region = view.word(region.a)
-        # add the region since nothing is selected yet
-        view.sel().add(region)
-      # filter by substring (word or not)
-      substr = view.substr(region)
-      if substr and substr not in substrings:
-        regions.append(region)
-        substrings.append(substr)
-    view.sel().clear()
-    if regions:
-      for region in regions:
-        view.sel().add(region)
-    else:
-      view.window().status_message("Multi Find All: nothing selected")
-      for sel in initial:
-        view.sel().add(sel)
+
+    needles = selectNeedles(view, expand)
+    if not needles:
       return
 
-    selected_words = [view.substr(view.word(sel)).lower() for sel in view.sel()]
+    selectedWords = None
+    if word:
+      selectedWords = frozenset(view.substr(view.word(sel)).lower() for sel in view.sel())
 
-    for region in view.sel():
-      substr = view.substr(region)
+    cache = lib.load("find_all").FindAllCache.getOrConstructCacheForView(view)
 
-      if case:
-          for region in view.find_all(substr, sublime.LITERAL):
-            newRegions.append(region)
+    def onDone(matches):
+      # the matches of overlapping needles like foo and foobar are merged
+      # up front instead of one by one by the selection
+      view.sel().add_all(matches.merged().toRegions())
+
+    lib.load("scheduler").run(
+      view,
+      "Multi Find All",
+      cache.iterFindAll(view, needles, case, selectedWords, ignore_comments),
+      onDone
+    )
+
+
+
+@lib.instrument
+class MultiFindAllViewsCommand(sublime_plugin.WindowCommand):
+
+  # the results of the last search per window, so that they can be applied
+  # again without searching again
+  lastResults = {}
+
+  def run(self, case=True, word=False, ignore_comments=False, expand=True, show_last=False):
+
+    window = self.window
+
+    if show_last:
+      self.pruneResults()
+      results = self.lastResults.get(window.id())
+      if results:
+        self.showResults(results)
       else:
-          for region in view.find_all(substr, sublime.LITERAL | sublime.IGNORECASE):
-            newRegions.append(region)
+        window.status_message("Multi Find All: there are no results to show")
+      return
+
+    view = window.active_view()
+    if view is None:
+      return
 
-      if word:
-        deleted = [region for region in newRegions
-                   if view.substr(view.word(region)).lower() not in selected_words]
-        newRegions = [region for region in newRegions if region not in deleted]
+    needles = selectNeedles(view, expand)
+    if not needles:
+      return
+
+    selectedWords = None
+    if word:
+      selectedWords = set(view.substr(view.word(sel)).lower() for sel in view.sel())
+
+    views = bufferViews(window)
+    window.status_message("Multi Find All: searching {0} files".format(len(views)))
+    self.searchViews(
+      views,
+      needles,
+      case,
+      selectedWords,
+      lambda snapshots: self.onAllSearched(snapshots, ignore_comments)
+    )
+
+
+  def searchViews(self, views, needles, case, selectedWords, onDone):
+
+    # The views are searched in the pool, the future of a snapshot results in
+    # its matches. The word separators are read on the main thread.
+    findAll = lib.load("find_all")
+    wordSeparators = dict((view.id(), view.settings().get("word_separators", "")) for view in views)
+
+    def search(snapshot):
+      return findAll.findNeedlesInText(
+        snapshot.text,
+        needles,
+        case,
+        selectedWords,
+        wordSeparators[snapshot.view.id()]
+      )
+
+    return processViews(views, search, onDone)
+
+
+  def onAllSearched(self, snapshots, ignore_comments):
+
+    # only the matches of the snapshots are kept
+    results = []
+    for snapshot in snapshots:
+      view = snapshot.view
+      matches = snapshot.takeResult()
+
+      if not matches or not snapshot.isCurrent():
+        continue
 
       if ignore_comments:
-        deleted = [region for region in newRegions
-                   if re.search(r'\bcomment\b', view.scope_name(region.a))]
-        newRegions = [region for region in newRegions if region not in deleted]
+        matches = matches.filter(lambda a, b: not re.search(r'\bcomment\b', view.scope_name(a)))
+        if not matches:
+          continue
 
-    for region in newRegions:
-      view.sel().add(region)
+      snapshot.result = matches
+      results.append(snapshot)
+
+    self.pruneResults()
+    if not results:
+      self.lastResults.pop(self.window.id(), None)
+      self.window.status_message("Multi Find All: no matches in the open files")
+      return
+
+    self.lastResults[self.window.id()] = results
+
+    self.showResults(results)
+
+
+  @staticmethod
+  def pruneResults():
 
+    # the results keep their views alive, drop the ones of closed windows
+    windowIDs = set(window.id() for window in sublime.windows())
+    for windowID in list(MultiFindAllViewsCommand.lastResults.keys()):
+      if windowID not in windowIDs:
+        del MultiFindAllViewsCommand.lastResults[windowID]
+
+
+  @staticmethod
+  def forgetView(view):
+
+    # drop the results of a closed view, closing a window closes all of its views
+    lastResults = MultiFindAllViewsCommand.lastResults
+    for windowID, results in list(lastResults.items()):
+      remainingResults = [snapshot for snapshot in results if snapshot.view.id() != view.id()]
+      if remainingResults:
+        lastResults[windowID] = remainingResults
+      else:
+        del lastResults[windowID]
+
+
+  def showResults(self, results):
+
+    # the results are the snapshots of the views with their matches
+    items = []
+    for snapshot in results:
+      count = len(snapshot.result)
+      items.append([
+        snapshot.label(),
+        "{0} match{1}".format(count, "" if count == 1 else "es")
+      ])
+
+    def onDone(index):
+
+      if index != -1:
+        self.applyResult(results[index])
+
+    self.window.show_quick_panel(items, onDone)
+
+
+  def applyResult(self, snapshot):
+
+    view = snapshot.view
+
+    if not snapshot.isCurrent():
+      self.window.status_message("Multi Find All: the file was modified since the search")
+      return
+
+    selection = view.sel()
+    selection.clear()
+    # the matches are merged already, see findNeedlesInText
+    selection.add_all(snapshot.result.toRegions())
+
+    self.window.focus_view(view)
+    view.show(selection[0], False)
+
+
+
+@lib.instrument
 class MultiFindAllRegexCommand(sublime_plugin.TextCommand):
 
   def on_done(self, regex):
@@ -92,8 +372,9 @@ class MultiFindAllRegexCommand(sublime_plugin.TextCommand):
     self.case = case
     self.subtract = subtract
     c = "Additive regex search:" if not subtract else "Subtractive regex search:"
-    sublime.active_window().show_input_panel(c, "", self.on_done, None, None)
+    sublime.active_window().show_input_panel(c, "", lib.follow(self.on_done), None, None)
 
+@lib.instrument
 class MultiFindMenuCommand(sublime_plugin.TextCommand):
 
   def run(self, edit):
@@ -129,6 +410,7 @@ class MultiFindMenuCommand(sublime_plugin.TextCommand):
 
     self.view.window().show_quick_panel(choice, on_done, 1, 0, None)
 
+@lib.instrument
 class JumpToLastRegionCommand(sublime_plugin.TextCommand):
 
   def run(self, edit):
@@ -141,10 +423,19 @@ class JumpToLastRegionCommand(sublime_plugin.TextCommand):
     self.view.show(cursorPosition, False)
 
 
+@lib.instrument
 class AddLastSelectionCommand(sublime_plugin.TextCommand):
 
   def run(self, edit):
 
+    if lib.load("settings").get("selection_trace", False):
+      lib.load("selection_trace").record(self.view, "add_last_selection")
+
+    self.addLastSelection()
+
+
+  def addLastSelection(self):
+
     helper = Helper.getOrConstructHelperForView(self.view)
     lastSelections = helper.lastSelections
 
@@ -154,9 +445,12 @@ class AddLastSelectionCommand(sublime_plugin.TextCommand):
     currentSelection = self.view.sel()
     oldSelectionHash = Helper.hashSelection(currentSelection)
 
-    for region in lastSelections[-1]:
-      helper.ignoreSelectionCommand = True
-      currentSelection.add(region)
+    RegionArray = lib.load("region_array").RegionArray
+    regions = RegionArray.fromRegions(currentSelection)
+    regions.extend(lastSelections[-1])
+    helper.ignoreSelectionCommand = True
+    currentSelection.clear()
+    currentSelection.add_all(regions.merged().toRegions())
 
     newSelectionHash = Helper.hashSelection(currentSelection)
 
@@ -165,105 +459,206 @@ class AddLastSelectionCommand(sublime_plugin.TextCommand):
     nothingChanged = oldSelectionHash == newSelectionHash
     if nothingChanged:
       # Rerun if the previous selection was only a subset of the current selection.
-      self.run(edit)
+      self.addLastSelection()
 
 
-class CycleThroughRegionsCommand(sublime_plugin.TextCommand):
+@lib.instrument
+class SelectionRegisterCommand(sublime_plugin.TextCommand):
 
-  def run(self, edit):
+  # The registers are stored as hidden regions, so that Sublime keeps them
+  # positioned correctly while the buffer is edited. Their names are kept in
+  # the view settings.
+  actions = ["save", "restore", "union", "intersect", "subtract", "clear"]
 
-    view = self.view
-    visibleRegion = view.visible_region()
-    selectedRegions = view.sel()
+  def run(self, edit, action="save", name=None, target="selection"):
 
-    if not len(selectedRegions):
+    if action not in self.actions:
+      sublime.error_message(
+        "'{0}' is an invalid action for 'selection_register'.\n"
+        "Valid actions are: [{1}]"
+        .format(action, ", ".join(self.actions))
+      )
       return
 
-    nextRegion = None
+    if name is not None:
+      self.runWithName(action, name, target)
+      return
 
-    # Find the first region which comes after the visible region.
-    for region in selectedRegions:
-      if region.end() > visibleRegion.b:
-        nextRegion = region
-        break
+    names = self.getNames()
+
+    if action == "save":
+      inputView = self.view.window().show_input_panel(
+        "Name of the selection register",
+        names[-1] if names else "",
+        lib.follow(lambda name: self.runWithName(action, name, target)),
+        None,
+        None
+      )
+      inputView.run_command("select_all")
+    elif names:
+      def onDone(index):
+        if index != -1:
+          self.runWithName(action, names[index], target)
 
-    # If the last region in the buffer was reached, take the first region.
-    # Empty regions will be evaluated falsy, which is why short-circuit evaluation doesn't work here.
-    if nextRegion is None:
-      nextRegion = selectedRegions[0]
+      self.view.window().show_quick_panel(names, onDone)
+    else:
+      sublime.status_message("There are no selection registers.")
 
-    view.show(nextRegion, False)
 
+  def runWithName(self, action, name, target):
 
+    # this is also called from panels, hence the command is run again so that
+    # an edit is available
+    self.view.run_command("selection_register_apply", {
+      "action": action,
+      "name": name,
+      "target": target
+    })
 
-class NormalizeRegionEndsCommand(sublime_plugin.TextCommand):
 
-  def run(self, edit):
+  def getNames(self):
+
+    return self.view.settings().get("meu_selection_registers", [])
+
+
+
+@lib.instrument
+class SelectionRegisterApplyCommand(sublime_plugin.TextCommand):
+
+  def run(self, edit, action, name, target="selection"):
 
     view = self.view
-    selection = view.sel()
+    regionSet = lib.load("region_set")
+    key = "meu_register." + name
+    names = view.settings().get("meu_selection_registers", [])
+
+    if action == "clear":
+      view.erase_regions(key)
+      if name in names:
+        names.remove(name)
+        view.settings().set("meu_selection_registers", names)
+      return
 
-    if not len(selection):
+    if action != "save" and name not in names:
+      sublime.status_message("The selection register '{0}' is empty.".format(name))
       return
 
-    if self.areRegionsNormalized(selection):
-      regions = self.invertRegions(selection)
+    selection = view.sel()
+    RegionArray = lib.load("region_array").RegionArray
+    selectedRegions = regionSet.canonicalize(RegionArray.fromRegions(selection))
+    register = regionSet.canonicalize(RegionArray.fromRegions(view.get_regions(key)))
+
+    if action == "save":
+      result = selectedRegions
+      target = "register"
+    elif action == "restore":
+      result = register
+      target = "selection"
+    elif action == "union":
+      result = regionSet.union(selectedRegions, register)
+    elif action == "intersect":
+      result = regionSet.intersect(selectedRegions, register)
+    else:
+      result = regionSet.subtract(selectedRegions, register)
+
+    regions = result.toRegions()
+
+    if target == "register":
+      view.add_regions(key, regions, "", "", sublime.HIDDEN | sublime.PERSISTENT)
+      if name not in names:
+        names.append(name)
+        view.settings().set("meu_selection_registers", names)
+      sublime.status_message("Saved {0} regions to the selection register '{1}'.".format(len(regions), name))
+    elif regions:
+      selection.clear()
+      selection.add_all(regions)
+      view.show(regions[0], False)
     else:
-      regions = self.normalizeRegions(selection)
+      sublime.status_message("The result is empty, the selection was not changed.")
 
-    selection.clear()
-    for region in regions:
-      selection.add(region)
 
-    firstVisibleRegion = self.findFirstVisibleRegion()
-    if firstVisibleRegion is not None:
-      # if firstVisibleRegion won't work with empty regions
-      view.show(firstVisibleRegion.b, False)
 
+@lib.instrument
+class CycleThroughRegionsCommand(sublime_plugin.TextCommand):
 
-  def findFirstVisibleRegion(self):
+  def run(self, edit, forward=True, step=1):
 
-    visibleRegion = self.view.visible_region()
+    view = self.view
+    helper = Helper.getOrConstructHelperForView(view)
+    regions = helper.getSelectionEndpoints(view)
+    begins, ends = regions.a, regions.b
+    regionCount = len(regions)
 
-    for region in self.view.sel():
-      if region.intersects(visibleRegion):
-        return region
+    if not regionCount:
+      return
 
-    return None
+    visibleRegion = view.visible_region()
+    step = max(step, 1)
 
+    if forward:
+      # Find the first region which comes after the visible region.
+      index = bisect_right(ends, visibleRegion.b) + step - 1
+    else:
+      # Find the last region which begins before the visible region.
+      index = bisect_left(begins, visibleRegion.a) - step
 
-  def normalizeRegions(self, regions):
+    # If the first or last region in the buffer was passed, wrap around.
+    index %= regionCount
 
-    return self.invertRegions(regions, lambda region: region.a > region.b)
+    view.show(sublime.Region(begins[index], ends[index]), False)
 
 
-  def invertRegions(self, regions, condition = lambda region: True):
 
-    invertedRegions = []
+@lib.instrument
+class NormalizeRegionEndsCommand(sublime_plugin.TextCommand):
 
-    for region in regions:
-      invertedRegion = region
-      if condition(region):
-        invertedRegion = sublime.Region(region.b, region.a)
+  def run(self, edit):
 
-      invertedRegions.append(invertedRegion)
+    view = self.view
+    selection = view.sel()
 
-    return invertedRegions
+    if not len(selection):
+      return
+
+    # fetch the selection only once
+    RegionArray = lib.load("region_array").RegionArray
+    selectedRegions = RegionArray.fromRegions(selection)
+    areRegionsNormalized = all(a < b for a, b in selectedRegions)
+
+    # If all regions are normalized, invert them. Otherwise only normalize the
+    # reversed ones. The first visible region is searched in the same pass.
+    visibleRegion = view.visible_region()
+    firstVisibleRegion = None
+    regions = []
 
+    for a, b in selectedRegions:
+      if areRegionsNormalized or a > b:
+        a, b = b, a
 
-  def areRegionsNormalized(self, regions):
+      region = sublime.Region(a, b)
+      regions.append(region)
 
-    return all(region.a < region.b for region in regions)
+      if firstVisibleRegion is None and region.intersects(visibleRegion):
+        firstVisibleRegion = region
+
+    selection.clear()
+    selection.add_all(regions)
+
+    if firstVisibleRegion is not None:
+      # if firstVisibleRegion won't work with empty regions
+      view.show(firstVisibleRegion.b, False)
 
 
 
+@lib.instrument
 class SplitSelectionCommand(sublime_plugin.TextCommand):
 
   def run(self, edit, separator = None):
 
-    self.savedSelection = [r for r in self.view.sel()]
+    RegionArray = lib.load("region_array").RegionArray
+    self.savedSelection = RegionArray.fromRegions(self.view.sel())
 
-    selectionSize = sum(map(lambda region: region.size(), self.savedSelection))
+    selectionSize = sum(self.savedSelection.sizes())
     if selectionSize == 0:
       # nothing to do
       sublime.status_message("Cannot split an empty selection.")
@@ -274,11 +669,12 @@ class SplitSelectionCommand(sublime_plugin.TextCommand):
     else:
       onConfirm, onChange = self.getHandlers()
 
+      # a profile of this command is taken of the split, not of opening the panel
       inputView = sublime.active_window().show_input_panel(
         "Separating character(s) for splitting the selection",
         " ",
-        onConfirm,
-        onChange,
+        onConfirm and lib.follow(onConfirm),
+        onChange and lib.follow(onChange),
         self.restoreSelection
       )
 
@@ -287,8 +683,7 @@ class SplitSelectionCommand(sublime_plugin.TextCommand):
 
   def getHandlers(self):
 
-    settings = sublime.load_settings("MultiEditUtils.sublime-settings")
-    live_split_selection = settings.get("live_split_selection")
+    live_split_selection = lib.load("settings").get("live_split_selection")
 
     if live_split_selection:
       onConfirm = None
@@ -302,22 +697,35 @@ class SplitSelectionCommand(sublime_plugin.TextCommand):
 
   def restoreSelection(self):
 
+    lib.load("scheduler").cancel(self.view)
     selection = self.view.sel()
     selection.clear()
-    for region in self.savedSelection:
-      selection.add(region)
+    selection.add_all(self.savedSelection.toRegions())
 
     self.workaroundForRefreshBug(self.view, selection)
 
 
   def splitSelection(self, separator):
 
+    lib.load("scheduler").run(
+      self.view,
+      "Split selection",
+      self.iterSplitSelection(separator),
+      self.applySplitSelection
+    )
+
+
+  def iterSplitSelection(self, separator):
+
     view = self.view
-    newRegions = []
+    RegionArray = lib.load("region_array").RegionArray
+    newRegions = RegionArray()
+    regionCount = len(self.savedSelection)
 
-    for region in self.savedSelection:
-      currentPosition = region.begin()
-      regionString = view.substr(region)
+    for index, (a, b) in enumerate(self.savedSelection):
+      yield index / regionCount
+      currentPosition = min(a, b)
+      regionString = view.substr(sublime.Region(a, b))
 
       if separator:
         subRegions = regionString.split(separator)
@@ -326,17 +734,18 @@ class SplitSelectionCommand(sublime_plugin.TextCommand):
         subRegions = list(regionString)
 
       for subRegion in subRegions:
-        newRegion = sublime.Region(
-          currentPosition,
-          currentPosition + len(subRegion)
-        )
-        newRegions.append(newRegion)
+        newRegions.append(currentPosition, currentPosition + len(subRegion))
         currentPosition += len(subRegion) + len(separator)
 
+    return newRegions
+
+
+  def applySplitSelection(self, newRegions):
+
+    view = self.view
     selection = view.sel()
     selection.clear()
-    for region in newRegions:
-      selection.add(region)
+    selection.add_all(newRegions.toRegions())
 
     self.workaroundForRefreshBug(view, selection)
 
@@ -351,21 +760,29 @@ class SplitSelectionCommand(sublime_plugin.TextCommand):
 
 
 
-Case = namedtuple("Case", "lower upper capitalized mixed")(1, 2, 3, 4)
-StringMetaData = namedtuple("StringMetaData", "separator cases stringGroups")
+# the delay in milliseconds after the last keystroke, until the preview is updated
+previewDelay = 150
+previewTemplate = '<span style="color: var(--greenish)">\u2192 {0}</span>'
+
 
 
+@lib.instrument
 class PreserveCaseCommand(sublime_plugin.TextCommand):
 
-  def run(self, edit, newString = None, selections = None):
+  def run(self, edit, newString = None, selections = None, mapping = None):
 
     self.edit = edit
+    if mapping is not None:
+      self.preserveCaseWithMapping(mapping)
+      return
+
+    RegionArray = lib.load("region_array").RegionArray
     if selections is not None:
-      self.savedSelection = [sublime.Region(r[0], r[1]) for r in selections]
+      self.savedSelection = RegionArray.fromRegions(sublime.Region(a, b) for a, b in selections)
     else:
-      self.savedSelection = [r for r in self.view.sel()]
+      self.savedSelection = RegionArray.fromRegions(self.view.sel())
 
-    selectionSize = sum(map(lambda region: region.size(), self.savedSelection))
+    selectionSize = sum(self.savedSelection.sizes())
     if selectionSize == 0:
       sublime.status_message("Cannot run preserve case on an empty selection.")
       return
@@ -373,167 +790,579 @@ class PreserveCaseCommand(sublime_plugin.TextCommand):
     if newString != None:
       self.preserveCase(newString)
     else:
-      firstRegionString = self.view.substr(self.savedSelection[0])
+      firstRegionString = self.view.substr(self.savedSelection.region(0))
+      # a profile of this command is taken of the replacement, not of opening the panel
       inputView = sublime.active_window().show_input_panel(
         "New string for preserving case",
         firstRegionString,
-        self.runPreserveCase,
-        None,
-        None
+        lib.follow(self.runPreserveCase),
+        self.schedulePreview,
+        self.erasePreview
       )
       inputView.run_command("select_all")
 
 
   def runPreserveCase(self, newString):
-    selections = [[s.a, s.b] for s in self.savedSelection]
+    self.erasePreview()
+    selections = [[a, b] for a, b in self.savedSelection]
     self.view.run_command("preserve_case", {"newString": newString, "selections": selections})
 
 
+  def schedulePreview(self, newString):
+
+    # the preview is only updated once the input rests for a moment
+    if not hasattr(sublime, "PhantomSet"):
+      return
+
+    self.previewGeneration = getattr(self, "previewGeneration", 0) + 1
+    generation = self.previewGeneration
+
+    def update():
+      if generation == self.previewGeneration:
+        self.showPreview(newString)
+
+    sublime.set_timeout(update, previewDelay)
+
+
+  def showPreview(self, newString):
+
+    # show the replacement behind every visible region, every distinct string
+    # of the selection is only transformed once
+    import html
+
+    view = self.view
+    caseAnalysis = lib.load("case_analysis")
+    newStringGroups = caseAnalysis.analyzeString(newString).stringGroups
+    visibleRegion = view.visible_region()
+    regions = self.savedSelection.normalized()
+
+    previews = {}
+    phantoms = []
+    for index in range(bisect_left(regions.b, visibleRegion.begin()), len(regions)):
+      begin, end = regions[index]
+      if begin > visibleRegion.end():
+        break
+      if begin == end:
+        continue
+
+      regionString = view.substr(sublime.Region(begin, end))
+      preview = previews.get(regionString)
+      if preview is None:
+        preview = caseAnalysis.replaceStringWithCase(regionString, list(newStringGroups))
+        previews[regionString] = preview
+
+      phantoms.append(sublime.Phantom(
+        sublime.Region(end),
+        previewTemplate.format(html.escape(preview, quote=False)),
+        sublime.LAYOUT_INLINE
+      ))
+
+    if not hasattr(self, "previewPhantoms"):
+      self.previewPhantoms = sublime.PhantomSet(view, "meu_preserve_case_preview")
+    self.previewPhantoms.update(phantoms)
+
+
+  def erasePreview(self):
+
+    # invalidate a pending update as well
+    self.previewGeneration = getattr(self, "previewGeneration", 0) + 1
+    if hasattr(self, "previewPhantoms"):
+      self.previewPhantoms.update([])
+
+
   def preserveCase(self, newString):
 
     view = self.view
-    regionOffset = 0
-    newStringGroups = self.analyzeString(newString).stringGroups
+    lib.load("scheduler").run(
+      view,
+      "Preserve case",
+      self.iterPreserveCase(newString),
+      lambda replacements: replaceRegions(view, *replacements)
+    )
 
-    for region in self.savedSelection:
-      region = sublime.Region(region.begin() + regionOffset, region.end() + regionOffset)
-      regionString = view.substr(region)
 
-      newRegionString = self.replaceStringWithCase(regionString, newStringGroups)
-      view.replace(self.edit, region, newRegionString)
-      regionOffset += len(newRegionString) - len(regionString)
+  def preserveCaseWithMapping(self, mapping):
 
+    # rename all case variants of the keys in the whole buffer at once
+    view = self.view
+    text = view.substr(sublime.Region(0, view.size()))
 
-  def analyzeString(self, aString):
+    def onDone(replacements):
+      begins, ends, newStrings = replacements
+      if not newStrings:
+        sublime.status_message("Preserve case: nothing to replace.")
+        return
 
-    separators = "-_/. "
-    counts = list(map(lambda sep: aString.count(sep), separators))
-    maxCounts = max(counts)
+      RegionArray = lib.load("region_array").RegionArray
+      replaceRegions(view, RegionArray(begins, ends), newStrings)
+      sublime.status_message("Preserve case: replaced {0} occurrences.".format(len(newStrings)))
 
-    if max(counts) > 0:
-      separator = separators[counts.index(maxCounts)]
-      stringGroups = aString.split(separator)
-    else:
-      # no real separator
-      separator = ""
-      stringGroups = self.splitByCase(aString)
+    lib.load("scheduler").run(
+      view,
+      "Preserve case",
+      lib.load("case_analysis").iterPlanReplacements(text, mapping),
+      onDone
+    )
 
-    cases = list(map(self.analyzeCase, stringGroups))
 
-    return StringMetaData(separator, cases, stringGroups)
+  def iterPreserveCase(self, newString):
 
+    # plan the replacements, they are applied in one edit at the end
+    view = self.view
+    caseAnalysis = lib.load("case_analysis")
+    newStringGroups = caseAnalysis.analyzeString(newString).stringGroups
+    regions = self.savedSelection.normalized()
+    newRegionStrings = []
 
-  def splitByCase(self, aString):
+    for index, (begin, end) in enumerate(regions):
+      if index % 100 == 0:
+        yield index / len(regions)
+      regionString = view.substr(sublime.Region(begin, end))
+      # replaceStringWithCase changes the groups in place
+      newRegionStrings.append(caseAnalysis.replaceStringWithCase(regionString, list(newStringGroups)))
 
-    # split at the change from lower to upper case (or vice versa)
-    # groups = re.split('(?<!^)((?:[^A-Z][A-Z])|(?:[A-Z]{2,}[^A-Z]))', aString)
-    groups = re.split('(?<!^)((?:[^A-Z][^a-z])|(?:[^a-z][^A-Z]))', aString)
-    newGroups = [groups[0]]
-    for index, group in enumerate(groups):
-      if index % 2 == 1:
-        newGroups[-1] += group[0:-1]
-        newGroups.append(group[-1] + groups[index + 1])
+    return regions, newRegionStrings
 
-    return newGroups
 
+  def analyzeString(self, aString):
 
-  def analyzeCase(self, aString):
+    return lib.load("case_analysis").analyzeString(aString)
 
-    lowerReg = re.compile("^[^A-Z]*$")
-    upperReg = re.compile("^[^a-z]*$")
-    capitalizedReg = re.compile("^[A-Z]([^A-Z])*$")
 
-    if lowerReg.match(aString):
-      return Case.lower
-    elif upperReg.match(aString):
-      return Case.upper
-    elif capitalizedReg.match(aString):
-      return Case.capitalized
-    else:
-      return Case.mixed
+  def splitByCase(self, aString):
+
+    return lib.load("case_analysis").splitByCase(aString)
+
+
+  def analyzeCase(self, aString):
+
+    return lib.load("case_analysis").analyzeCase(aString)
 
 
   def replaceStringWithCase(self, oldString, newStringGroups):
 
-    analyzedOldString = self.analyzeString(oldString)
-    oldCases = analyzedOldString.cases
-    oldSeparator = analyzedOldString.separator
+    return lib.load("case_analysis").replaceStringWithCase(oldString, newStringGroups)
 
-    for index, currentElement in enumerate(newStringGroups):
-      # If the user provides more new strings than old ones are given, we just
-      # repeat the last case.
-      clampedIndex = min(index, len(oldCases) - 1)
-      currentCase = oldCases[clampedIndex]
 
-      if currentCase == Case.upper:
-        newStringGroups[index] = currentElement.upper()
-      elif currentCase == Case.lower:
-        newStringGroups[index] = currentElement.lower()
-      elif currentCase == Case.capitalized:
-        newStringGroups[index] = currentElement.capitalize()
 
-    return oldSeparator.join(newStringGroups)
+def replaceRegions(view, regions, strings):
 
+  # Replace the regions of a RegionArray with the strings in one edit. They are
+  # handed over to the command directly, since command arguments are
+  # serialized.
+  ReplaceRegionsCommand.pending[view.id()] = (regions, strings)
+  view.run_command("replace_regions")
 
 
-class StripSelection(sublime_plugin.TextCommand):
+
+@lib.instrument
+class ReplaceRegionsCommand(sublime_plugin.TextCommand):
+
+  pending = {}
 
   def run(self, edit):
 
-    newRegions = []
-    selection = self.view.sel()
+    regions, strings = self.pending.pop(self.view.id(), (None, None))
+    if regions is None:
+      return
 
-    for currentRegion in selection:
+    # Replace from the end of the buffer, so that the remaining regions don't
+    # move. The regions must not overlap.
+    begins = regions.begins()
+    ends = regions.ends()
+    for index in sorted(range(len(regions)), key=begins.__getitem__, reverse=True):
+      self.view.replace(edit, sublime.Region(begins[index], ends[index]), strings[index])
+
+
+
+@lib.instrument
+class PreserveCaseViewsCommand(sublime_plugin.WindowCommand):
+
+  def run(self, mapping=None, newString=None):
+
+    window = self.window
+
+    if mapping is None:
+      # rename the first selected string or the word under the cursor
+      view = window.active_view()
+      if view is None or not len(view.sel()):
+        return
+
+      region = view.sel()[0]
+      if region.empty():
+        region = view.word(region.a)
+      oldString = view.substr(region)
+      if not oldString.strip():
+        window.status_message("Preserve case: nothing selected")
+        return
+
+      if newString is None:
+        inputView = window.show_input_panel(
+          "Rename in all files",
+          oldString,
+          lib.follow(
+            lambda newString: window.run_command("preserve_case_views", {"mapping": {oldString: newString}})
+          ),
+          None,
+          None
+        )
+        inputView.run_command("select_all")
+        return
 
-      text = self.view.substr(currentRegion)
+      mapping = {oldString: newString}
 
-      lStrippedText = text.lstrip()
-      rStrippedText = lStrippedText.rstrip()
+    views = bufferViews(window)
+    if not views or not any(mapping):
+      return
+
+    window.status_message("Preserve case: planning the replacements in {0} files".format(len(views)))
+    self.planViews(views, mapping, self.onAllPlanned)
+
+
+  def planViews(self, views, mapping, onDone):
+
+    # The replacements are planned in the pool, the future of a snapshot
+    # results in the planned replacements and the duration of the planning.
+    import time
+
+    caseAnalysis = lib.load("case_analysis")
+
+    def plan(snapshot):
+      start = time.perf_counter()
+      replacements = caseAnalysis.planReplacements(snapshot.text, mapping)
+      return replacements, time.perf_counter() - start
 
-      lStrippedCount = len(text) - len(lStrippedText)
-      rStrippedCount = len(lStrippedText) - len(rStrippedText)
+    return processViews(views, plan, onDone)
 
-      a = currentRegion.begin() + lStrippedCount
-      b = currentRegion.end() - rStrippedCount
+
+  def onAllPlanned(self, snapshots):
+
+    # apply the replacements of every view, which wasn't modified in the
+    # meantime, in one edit and report the counts and the timings per file
+    import time
+
+    lines = []
+    replacedCount = fileCount = 0
+
+    for snapshot in snapshots:
+      view = snapshot.view
+      (begins, ends, newStrings), duration = snapshot.takeResult()
+
+      if not view.is_valid():
+        continue
+
+      if not snapshot.isCurrent():
+        outcome = "skipped, the file was modified"
+      elif newStrings and view.is_read_only():
+        outcome = "skipped, the file is read-only"
+      else:
+        if newStrings:
+          start = time.perf_counter()
+          RegionArray = lib.load("region_array").RegionArray
+          replaceRegions(view, RegionArray(begins, ends), newStrings)
+          duration += time.perf_counter() - start
+          replacedCount += len(newStrings)
+          fileCount += 1
+        outcome = "{0} replacement{1}".format(len(newStrings), "" if len(newStrings) == 1 else "s")
+
+      lines.append("{0:<40} {1:>9.1f} ms  {2}".format(outcome, duration * 1000, snapshot.label()))
+
+    panel = self.window.create_output_panel("preserve_case_views")
+    panel.run_command("append", {"characters": "\n".join(lines) + "\n"})
+    self.window.run_command("show_panel", {"panel": "output.preserve_case_views"})
+
+    self.window.status_message(
+      "Preserve case: replaced {0} occurrences in {1} files".format(replacedCount, fileCount)
+    )
+
+
+
+def transformSelection(view, transform):
+
+  # Replace the texts of the selected regions with transform(texts) in one
+  # edit. The texts are fetched with a single substr call and the new texts
+  # are selected afterwards.
+  RegionArray = lib.load("region_array").RegionArray
+  regions = RegionArray.fromRegions(view.sel())
+  if not len(regions):
+    return
+
+  normalized = regions.normalized()
+  offset = normalized.a[0]
+  text = view.substr(sublime.Region(offset, normalized.b[-1]))
+  strings = [text[begin - offset:end - offset] for begin, end in normalized]
+  newStrings = transform(strings)
+
+  replaceRegions(view, normalized, newStrings)
+
+  # the regions keep their direction
+  newRegions = RegionArray()
+  shift = 0
+  for (a, b), oldString, newString in zip(regions, strings, newStrings):
+    begin = min(a, b) + shift
+    end = begin + len(newString)
+    newRegions.append(*((begin, end) if a <= b else (end, begin)))
+    shift += len(newString) - len(oldString)
+
+  selection = view.sel()
+  selection.clear()
+  selection.add_all(newRegions.toRegions())
+
+
+
+@lib.instrument
+class SortSelectionCommand(sublime_plugin.TextCommand):
+
+  def run(self, edit, case_sensitive=True, reverse=False):
+
+    key = None if case_sensitive else str.lower
+    transformSelection(self.view, lambda strings: sorted(strings, key=key, reverse=reverse))
+
+
+
+@lib.instrument
+class ReverseSelectionCommand(sublime_plugin.TextCommand):
+
+  def run(self, edit):
+
+    transformSelection(self.view, lambda strings: strings[::-1])
+
+
+
+@lib.instrument
+class UniqueSelectionCommand(sublime_plugin.TextCommand):
+
+  def run(self, edit):
+
+    # the distinct texts in the order of their first occurrence, the remaining
+    # regions are emptied
+    def unique(strings):
+      uniqueStrings = list(OrderedDict.fromkeys(strings))
+      return uniqueStrings + [""] * (len(strings) - len(uniqueStrings))
+
+    transformSelection(self.view, unique)
+
+
+
+@lib.instrument
+class InsertSequenceCommand(sublime_plugin.TextCommand):
+
+  def run(self, edit, start=1, step=1, format="{0}"):
+
+    transformSelection(
+      self.view,
+      lambda strings: [format.format(start + index * step) for index in range(len(strings))]
+    )
+
+
+
+@lib.instrument
+class SelectionStatsCommand(sublime_plugin.TextCommand):
+
+  def run(self, edit, top=10):
+
+    view = self.view
+    RegionArray = lib.load("region_array").RegionArray
+    regions = RegionArray.fromRegions(view.sel())
+    if not len(regions):
+      return
+
+    selectionStats = lib.load("selection_stats")
+    begin = min(regions.begins())
+    end = max(regions.ends())
+    stats = selectionStats.collect(regions, view.substr(sublime.Region(begin, end)), begin, top)
+    report = selectionStats.formatStats(stats, view.rowcol(begin)[0] + 1, view.rowcol(end)[0] + 1)
+
+    window = view.window()
+    panel = window.create_output_panel("selection_stats")
+    panel.run_command("append", {"characters": report})
+    window.run_command("show_panel", {"panel": "output.selection_stats"})
+
+
+
+@lib.instrument
+class StripSelection(sublime_plugin.TextCommand):
+
+  def run(self, edit, chars=None):
+
+    view = self.view
+    selection = view.sel()
+
+    if not len(selection):
+      return
+
+    # Fetch the text of all regions at once and only scan it by index, so that
+    # no stripped copies of the region texts are created.
+    offset = selection[0].begin()
+    text = view.substr(sublime.Region(offset, selection[-1].end()))
+
+    if chars is None:
+      leadingPattern = re.compile(r"\s*")
+      isStripped = str.isspace
+    else:
+      leadingPattern = re.compile("[{0}]*".format(re.escape(chars)) if chars else "")
+      isStripped = lambda character: character in chars
+
+    RegionArray = lib.load("region_array").RegionArray
+    newRegions = RegionArray()
+
+    for currentRegion in selection:
+
+      end = currentRegion.end() - offset
+      a = leadingPattern.match(text, currentRegion.begin() - offset, end).end()
+      b = end
+
+      while b > a and isStripped(text[b - 1]):
+        b -= 1
 
       if a == b:
         # the region only contained whitespace
         # use the old selection end to avoid jumping of cursor
-        a = b = currentRegion.b
-
-      newRegions.append(sublime.Region(a, b))
+        newRegions.append(currentRegion.b, currentRegion.b)
+      else:
+        newRegions.append(a + offset, b + offset)
 
 
     selection.clear()
-    for region in newRegions:
-      selection.add(region)
+    selection.add_all(newRegions.toRegions())
 
 
 
-class RemoveEmptyRegions(sublime_plugin.TextCommand):
+@lib.instrument
+class MergeRegionsCommand(sublime_plugin.TextCommand):
 
-  def run(self, edit):
+  def run(self, edit, tolerance=0):
 
+    # Merge the regions which overlap or are at most tolerance characters
+    # apart. A negative tolerance only merges overlapping regions.
     selection = self.view.sel()
-    regions = list(selection)
-    newRegions = list(filter(lambda r: not r.empty(), regions))
+    RegionArray = lib.load("region_array").RegionArray
+    regions = RegionArray.fromRegions(selection)
+    merged = regions.merged(tolerance if tolerance >= 0 else None)
 
-    if len(newRegions) == 0:
-      sublime.status_message("There are only empty regions. Removing those would remove all regions. Aborting.")
+    if len(merged) == len(regions):
+      sublime.status_message("Merge regions: there is nothing to merge.")
       return
 
     selection.clear()
-    for r in newRegions:
-      selection.add(r)
+    selection.add_all(merged.toRegions())
+    sublime.status_message("Merge regions: merged {0} regions into {1}.".format(len(regions), len(merged)))
+
+
 
+def filterSelection(view, predicates, invert=False, message=None):
 
+  # Keep the regions for which all predicates hold in a single pass. With
+  # invert the regions are kept, for which at least one predicate fails. The
+  # predicates get the index, begin and end of a region, which are visited in
+  # the order of the selection. The selection is kept if no region would be
+  # left.
+  selection = view.sel()
+  RegionArray = lib.load("region_array").RegionArray
+  regions = RegionArray.fromRegions(selection)
+  begins, ends = regions.begins(), regions.ends()
+  newRegions = RegionArray()
 
+  for index, (a, b) in enumerate(regions):
+    begin, end = begins[index], ends[index]
+    if all(predicate(index, begin, end) for predicate in predicates) != invert:
+      newRegions.append(a, b)
+
+  if len(newRegions) == 0:
+    sublime.status_message(message or "Filter regions: no region would be left. Aborting.")
+    return False
+
+  if len(newRegions) < len(regions):
+    selection.clear()
+    selection.add_all(newRegions.toRegions())
+
+  return True
+
+
+
+@lib.instrument
+class FilterRegionsCommand(sublime_plugin.TextCommand):
+
+  def run(self, edit, min_length=None, max_length=None, regex=None, case=True,
+          scope=None, lines=None, every=None, offset=0, invert=False):
+
+    view = self.view
+    selection = view.sel()
+    if not len(selection):
+      return
+
+    predicates = []
+
+    if every is not None:
+      if every < 1:
+        sublime.status_message("Filter regions: every has to be at least 1.")
+        return
+      # every n-th region, counted from offset
+      remainder = offset % every
+      predicates.append(lambda index, begin, end: index % every == remainder)
+
+    if min_length is not None:
+      predicates.append(lambda index, begin, end: end - begin >= min_length)
+
+    if max_length is not None:
+      predicates.append(lambda index, begin, end: end - begin <= max_length)
+
+    if regex is not None or lines is not None:
+      # the text of all regions is fetched at once
+      textOffset = selection[0].begin()
+      text = view.substr(sublime.Region(textOffset, max(region.end() for region in selection)))
+
+      if lines is not None:
+        # the lines are 1-based and inclusive, the line of a region is the line
+        # of its begin, which is counted from the previous region
+        firstLine, lastLine = lines
+        current = [view.rowcol(textOffset)[0] + 1, 0]
+
+        def isInLines(index, begin, end):
+          position = begin - textOffset
+          current[0] += text.count("\n", current[1], position)
+          current[1] = position
+          return firstLine <= current[0] <= lastLine
+
+        predicates.append(isInLines)
+
+      if regex is not None:
+        pattern = re.compile(regex, 0 if case else re.IGNORECASE)
+        predicates.append(
+          lambda index, begin, end: pattern.search(text[begin - textOffset:end - textOffset]) is not None
+        )
+
+    if scope is not None:
+      predicates.append(lambda index, begin, end: view.match_selector(begin, scope))
+
+    filterSelection(view, predicates, invert)
+
+
+
+@lib.instrument
+class RemoveEmptyRegions(sublime_plugin.TextCommand):
+
+  def run(self, edit):
+
+    filterSelection(
+      self.view,
+      [lambda index, begin, end: begin != end],
+      message="There are only empty regions. Removing those would remove all regions. Aborting."
+    )
+
+
+
+@lib.instrument
 class SelectionListener(sublime_plugin.EventListener):
 
   def on_selection_modified(self, view):
 
+    if lib.load("settings").get("selection_trace", False):
+      lib.load("selection_trace").record(view, "selection", view.sel())
+
     helper = Helper.getOrConstructHelperForView(view)
     lastSelections = helper.lastSelections
+    helper.selectionEndpoints = None
 
     if helper.ignoreSelectionCommand:
       helper.ignoreSelectionCommand = False
@@ -543,8 +1372,9 @@ class SelectionListener(sublime_plugin.EventListener):
 
     if self.isComplexSelection(currentSelection):
 
-      currentRegions = list(currentSelection)
-      selectionWasExpanded = lastSelections and self.isSubsetOf(currentSelection, lastSelections[-1])
+      RegionArray = lib.load("region_array").RegionArray
+      currentRegions = RegionArray.fromRegions(currentSelection)
+      selectionWasExpanded = lastSelections and self.isSubsetOf(currentRegions, lastSelections[-1])
 
       if selectionWasExpanded:
         # Override the last entry since the selection was expanded.
@@ -553,6 +1383,59 @@ class SelectionListener(sublime_plugin.EventListener):
         lastSelections.append(currentRegions)
 
 
+  def on_load_async(self, view):
+
+    if lib.load("settings").get("persist_selections", False):
+      lib.load("persistence").load(view, "history", lambda sections: self.restoreHistory(view, sections))
+
+
+  def restoreHistory(self, view, sections):
+
+    helper = Helper.getOrConstructHelperForView(view)
+    helper.lastSelections[:0] = sections.get("history", [])
+
+
+  def on_pre_close(self, view):
+
+    self.saveHistory(view, onClose=True)
+
+
+  def on_post_save_async(self, view):
+
+    self.saveHistory(view)
+
+
+  def saveHistory(self, view, onClose=False):
+
+    if lib.load("settings").get("persist_selections", False):
+      lib.load("persistence").save(view, "history", self.historySections(view), onClose)
+
+
+  def historySections(self, view):
+
+    # the sections for lib.persistence or None, if there is no history
+    lastSelections = Helper.getOrConstructHelperForView(view).lastSelections
+    if not lastSelections:
+      return None
+
+    return OrderedDict([("history", lastSelections[-Helper.maxPersistedSelections:])])
+
+
+  def on_close(self, view):
+
+    Helper.viewToHelperMap.pop(view.id(), None)
+
+    persistence = lib.loaded("persistence")
+    if persistence is not None:
+      persistence.forgetView(view)
+
+    findAll = lib.loaded("find_all")
+    if findAll is not None:
+      findAll.FindAllCache.viewToCacheMap.pop(view.id(), None)
+
+    MultiFindAllViewsCommand.forgetView(view)
+
+
   def isComplexSelection(self, selection):
     # A "complex selection" is a selection which is not empty or has multiple regions.
 
@@ -566,13 +1449,111 @@ class SelectionListener(sublime_plugin.EventListener):
     return regionCount > 1 or firstRegionLength > 0
 
 
-  def isSubsetOf(self, selectionA, selectionB):
-    # Check if selectionA is a subset of selectionB.
+  def isSubsetOf(self, regionsA, regionsB):
+    # Check if every region of regionsB is contained in a region of regionsA.
+    # Both are RegionArrays of selections, which are sorted and don't overlap.
+
+    normalized = regionsA.normalized()
+    return all(normalized.contains(a, b) for a, b in regionsB)
+
+
+
+@lib.instrument
+class FindAllIndexListener(sublime_plugin.EventListener):
+
+  # The trigram index of multi_find_all is built in the background. With the
+  # text changes of Sublime Text 4 it is updated incrementally, otherwise it is
+  # stale after a modification and rebuilt after a delay.
+
+  def on_load_async(self, view):
+
+    if lib.load("settings").get("find_all_index", False):
+      lib.load("trigram_index").scheduleBuild(view)
+
+
+  def on_activated_async(self, view):
+
+    if lib.load("settings").get("find_all_index", False):
+      trigramIndex = lib.load("trigram_index")
+      if trigramIndex.get(view) is None:
+        trigramIndex.scheduleBuild(view)
+
 
-    return all(selectionA.contains(region) for region in selectionB)
+  def on_modified_async(self, view):
 
+    trigramIndex = lib.loaded("trigram_index")
+    if trigramIndex is not None and trigramIndex.get(view) is None:
+      trigramIndex.scheduleBuild(view, 1000)
 
 
+  def on_close(self, view):
+
+    trigramIndex = lib.loaded("trigram_index")
+    if trigramIndex is not None:
+      trigramIndex.forgetView(view)
+
+
+
+if hasattr(sublime_plugin, "TextChangeListener"):
+
+  class FindAllIndexChangeListener(sublime_plugin.TextChangeListener):
+
+    @classmethod
+    def is_applicable(cls, buffer):
+
+      # Only the buffers which are large enough to be indexed send their
+      # changes. The index of a buffer, which only becomes large enough later
+      # on, is rebuilt after its modifications instead.
+      if not lib.load("settings").get("find_all_index", False):
+        return False
+
+      view = buffer.primary_view()
+      return view is not None and lib.load("trigram_index").isEnabled(view)
+
+
+    def on_text_changed(self, changes):
+
+      # The index is updated synchronously, since the changed blocks have to be
+      # read in the state right after the changes.
+      trigramIndex = lib.loaded("trigram_index")
+      view = self.buffer.primary_view()
+      if trigramIndex is not None and view is not None:
+        trigramIndex.onTextChanged(view, [(change.a.pt, change.b.pt, change.str) for change in changes])
+
+
+
+@lib.instrument
+class TaskContext(sublime_plugin.EventListener):
+
+  def on_query_context(self, view, key, operator, operand, match_all):
+
+    if key != "meu_task_running":
+      return None
+
+    scheduler = lib.loaded("scheduler")
+    result = scheduler is not None and scheduler.isRunning(view)
+
+    if operator == sublime.OP_EQUAL:
+      return result == operand
+    elif operator == sublime.OP_NOT_EQUAL:
+      return result != operand
+
+    return None
+
+
+
+@lib.instrument
+class MultiEditUtilsCancelCommand(sublime_plugin.TextCommand):
+
+  def run(self, edit):
+
+    scheduler = lib.loaded("scheduler")
+    if scheduler is None or not scheduler.cancel(self.view):
+      sublime.status_message("There is no running MultiEditUtils operation.")
+
+
+
+@lib.instrument
 class TriggerSelectionModifiedCommand(sublime_plugin.TextCommand):
 
   def run(self, edit):
@@ -581,15 +1562,66 @@ class TriggerSelectionModifiedCommand(sublime_plugin.TextCommand):
 
 
 
+class MultiEditUtilsProfileStatsCommand(sublime_plugin.WindowCommand):
+
+  def run(self, output="view", path=None, clear=False):
+
+    profiling = lib.load("profiling")
+    if clear:
+      profiling.clear()
+      sublime.status_message("MultiEditUtils: profiling data cleared")
+      return
+
+    stats = profiling.summarize()
+    if not stats:
+      sublime.status_message("MultiEditUtils: no profiling data, enable the \"profiling\" setting")
+      return
+
+    if output == "json":
+      if path is None:
+        import os
+        path = os.path.join(profiling.outputDirectory(), "profile.json")
+
+      profiling.writeStats(stats, path)
+      self.window.open_file(path)
+    else:
+      view = self.window.new_file()
+      view.set_name("MultiEditUtils Profile")
+      view.set_scratch(True)
+      view.run_command("append", {"characters": profiling.formatStats(stats)})
+      view.set_read_only(True)
+
+
+
+class MultiEditUtilsProfileNextCommand(sublime_plugin.WindowCommand):
+
+  def run(self, command=None, args=None):
+
+    # the commands are only instrumented while the profiling is enabled
+    lib.instrumentAll(force=True)
+    lib.load("profiling").profileNextCommand()
+
+    if command is not None:
+      self.window.run_command(command, args or {})
+    else:
+      sublime.status_message("MultiEditUtils: the next command will be profiled")
+
+
+
 class Helper:
 
   viewToHelperMap = {}
+  # the number of last selections which are saved with the file
+  maxPersistedSelections = 50
 
   def __init__(self):
 
     # The SelectionCommand should be ignored if it was triggered by AddLastSelectionCommand.
     self.ignoreSelectionCommand = False
     self.lastSelections = []
+    # The selected regions as sorted forward regions, see getSelectionEndpoints.
+    self.selectionEndpoints = None
+    self.selectionEndpointsKey = None
 
 
   @staticmethod
@@ -605,6 +1637,27 @@ class Helper:
     return helper
 
 
+  def getSelectionEndpoints(self, view):
+
+    # The forward selected regions are cached until the selection is modified.
+    # The change count, the region count and the first, middle and last region
+    # guard against missed selection events, e.g. if another plugin moves the
+    # selection without changing the number of regions.
+    selection = view.sel()
+    regionCount = len(selection)
+    key = (view.change_count(), regionCount)
+    if regionCount:
+      key += tuple((region.a, region.b) for region in
+                   [selection[0], selection[regionCount // 2], selection[-1]])
+
+    if self.selectionEndpoints is None or self.selectionEndpointsKey != key:
+      RegionArray = lib.load("region_array").RegionArray
+      self.selectionEndpoints = RegionArray.fromRegions(selection).normalized()
+      self.selectionEndpointsKey = key
+
+    return self.selectionEndpoints
+
+
   @staticmethod
   def hashSelection(selection):
 
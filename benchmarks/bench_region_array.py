@@ -0,0 +1,109 @@
+# Compare RegionArray with a plain list of Region objects: the memory of the
+# regions and the time of the operations, which the commands run on selections.
+#
+#   python benchmarks/bench_region_array.py [regionCount]
+
+import random
+import sys
+import time
+import tracemalloc
+from array import array
+from bisect import bisect_right
+
+import harness
+
+harness.setupPackage()
+import sublime
+
+
+def measure(function):
+
+  start = time.perf_counter()
+  result = function()
+  return result, time.perf_counter() - start
+
+
+def measureMemory(function):
+
+  # the memory is traced separately, since tracing slows down the allocations
+  tracemalloc.start()
+  result = function()
+  memory = tracemalloc.get_traced_memory()[0]
+  tracemalloc.stop()
+
+  return memory
+
+
+def mergeList(regions):
+
+  Region = sublime.Region
+  result = []
+  for region in sorted(regions, key=lambda region: (region.begin(), region.end())):
+    if result and region.begin() < result[-1].end():
+      last = result[-1]
+      result[-1] = Region(last.begin(), max(last.end(), region.end()))
+    else:
+      result.append(region)
+
+  return result
+
+
+def main():
+
+  regionCount = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+  RegionArray = harness.importModule("lib.region_array").RegionArray
+  Region = sublime.Region
+
+  random.seed(0)
+  points = [random.randrange(0, regionCount * 10) for _ in range(regionCount)]
+  lengths = [random.randrange(0, 20) for _ in range(regionCount)]
+  queries = [random.randrange(0, regionCount * 10) for _ in range(10000)]
+
+  buildList = lambda: [Region(point, point + length) for point, length in zip(points, lengths)]
+  buildArray = lambda: RegionArray(array("q", points), array("q", map(int.__add__, points, lengths)))
+
+  listMemory = measureMemory(buildList)
+  arrayMemory = measureMemory(buildArray)
+  regionList, listTime = measure(buildList)
+  regionArray, arrayTime = measure(buildArray)
+
+  rows = [("build", listTime, arrayTime)]
+
+  sortedList, listTime = measure(lambda: sorted(regionList, key=lambda region: (region.begin(), region.end())))
+  sortedArray, arrayTime = measure(regionArray.sorted)
+  rows.append(("sort", listTime, arrayTime))
+
+  mergedList, listTime = measure(lambda: mergeList(regionList))
+  mergedArray, arrayTime = measure(regionArray.merged)
+  rows.append(("merge overlapping", listTime, arrayTime))
+
+  def containsList():
+    begins = [region.begin() for region in mergedList]
+    return [region.contains(point) for point in queries
+            for region in [mergedList[max(bisect_right(begins, point) - 1, 0)]]]
+
+  normalizedArray = mergedArray.normalized()
+  _, listTime = measure(containsList)
+  _, arrayTime = measure(lambda: [normalizedArray.contains(point) for point in queries])
+  rows.append(("contains (10k points)", listTime, arrayTime))
+
+  _, listTime = measure(lambda: [Region(region.a + 1, region.b + 1) for region in regionList])
+  _, arrayTime = measure(lambda: regionArray.map(lambda a, b: (a + 1, b + 1)))
+  rows.append(("map", listTime, arrayTime))
+
+  # the conversion at the API boundary, which a list doesn't need
+  _, arrayTime = measure(regionArray.toRegions)
+  rows.append(("to Region objects", None, arrayTime))
+
+  print("{0} regions".format(regionCount))
+  print("{0:<24}{1:>14}{2:>14}".format("memory", "list", "RegionArray"))
+  print("{0:<24}{1:>11.1f} MB{2:>11.1f} MB".format("", listMemory / 1e6, arrayMemory / 1e6))
+  print()
+  print("{0:<24}{1:>14}{2:>14}".format("operation", "list", "RegionArray"))
+  for name, listTime, arrayTime in rows:
+    listColumn = "-" if listTime is None else "{0:.1f} ms".format(listTime * 1000)
+    print("{0:<24}{1:>14}{2:>11.1f} ms".format(name, listColumn, arrayTime * 1000))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,67 @@
+# Measure the import time of the plugin modules against the stub sublime module.
+# Every measurement runs in a fresh interpreter, so that no module is cached.
+#
+#   python benchmarks/bench_startup.py [repeat]
+
+import subprocess
+import sys
+
+from harness import benchmarkDirectory
+
+
+# the plugin modules, which Sublime Text loads on startup, and the modules,
+# which are only loaded on first use
+modules = [
+  "MultiEditUtils",
+  "selection_fields",
+  "lib.profiling",
+  "lib.case_analysis",
+  "lib.find_all",
+]
+
+measureScript = """
+import sys, time
+sys.path.insert(0, {directory!r})
+import harness
+harness.setupPackage()
+import sublime, sublime_plugin
+
+start = time.perf_counter()
+module = harness.importModule({module!r})
+imported = time.perf_counter()
+if hasattr(module, "plugin_loaded"):
+  module.plugin_loaded()
+loaded = time.perf_counter()
+
+print(imported - start, loaded - imported)
+"""
+
+
+def measure(module):
+
+  script = measureScript.format(directory=benchmarkDirectory, module=module)
+  output = subprocess.check_output([sys.executable, "-c", script])
+  importTime, loadTime = map(float, output.split())
+  return importTime, loadTime
+
+
+def main():
+
+  repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+  print("{0:<22}{1:>14}{2:>14}{3:>18}".format("module", "min import", "median import", "plugin_loaded"))
+  for module in modules:
+    times = [measure(module) for _ in range(repeat)]
+    importTimes = sorted(importTime for importTime, _ in times)
+    loadTimes = sorted(loadTime for _, loadTime in times)
+
+    print("{0:<22}{1:>11.2f} ms{2:>11.2f} ms{3:>15.2f} ms".format(
+      module,
+      importTimes[0] * 1000,
+      importTimes[len(importTimes) // 2] * 1000,
+      loadTimes[len(loadTimes) // 2] * 1000
+    ))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,32 @@
+# Shared setup of the benchmarks: the stub sublime modules are put on the path
+# and the repository is registered as the MultiEditUtils package, so that the
+# plugin modules can be imported like in Sublime Text.
+
+import importlib
+import os
+import sys
+import types
+
+
+benchmarkDirectory = os.path.dirname(os.path.abspath(__file__))
+packageDirectory = os.path.dirname(benchmarkDirectory)
+packageName = "MultiEditUtils"
+
+
+def setupPackage():
+
+  stubDirectory = os.path.join(benchmarkDirectory, "stub")
+  if stubDirectory not in sys.path:
+    sys.path.insert(0, stubDirectory)
+
+  if packageName not in sys.modules:
+    package = types.ModuleType(packageName)
+    package.__path__ = [packageDirectory]
+    sys.modules[packageName] = package
+
+
+def importModule(name):
+
+  setupPackage()
+  return importlib.import_module("{0}.{1}".format(packageName, name))
+
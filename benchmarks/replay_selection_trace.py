@@ -0,0 +1,94 @@
+# Replay a selection trace, which was recorded with the "selection_trace"
+# setting, against stub views: every selection change is passed to
+# SelectionListener.on_selection_modified and every add_last_selection call
+# runs AddLastSelectionCommand. Prints the latency per event type and the peak
+# memory of the selection history (Helper.lastSelections).
+#
+#   python benchmarks/replay_selection_trace.py path/to/selections.trace
+
+import sys
+import time
+
+import harness
+
+harness.setupPackage()
+import sublime
+
+
+def percentile(sortedValues, fraction):
+
+  return sortedValues[min(int(len(sortedValues) * fraction), len(sortedValues) - 1)]
+
+
+def historyMemory(helpers):
+
+  # the columns of the RegionArray entries, the Region objects are only
+  # created at the API boundary
+  return sum(
+    entry.a.itemsize * (len(entry.a) + len(entry.b))
+    for helper in helpers
+    for entry in helper.lastSelections
+  )
+
+
+def main():
+
+  if len(sys.argv) < 2:
+    print("usage: python benchmarks/replay_selection_trace.py path/to/selections.trace")
+    sys.exit(1)
+
+  plugin = harness.importModule("MultiEditUtils")
+  selectionTrace = harness.importModule("lib.selection_trace")
+  Region = sublime.Region
+  window = sublime.active_window()
+
+  listener = plugin.SelectionListener()
+  views = {}
+  latencies = {}
+  peakMemory = peakEntries = 0
+
+  for _, viewId, event, endpoints in selectionTrace.readTrace(sys.argv[1]):
+    view = views.get(viewId)
+    if view is None:
+      view = views[viewId] = window.new_file()
+
+    if event == "selection":
+      # setting the selection isn't part of the measurement
+      selection = view.sel()
+      selection.clear()
+      selection.add_all([Region(endpoints[i], endpoints[i + 1]) for i in range(0, len(endpoints), 2)])
+
+      start = time.perf_counter()
+      listener.on_selection_modified(view)
+      duration = time.perf_counter() - start
+    elif event == "add_last_selection":
+      start = time.perf_counter()
+      plugin.AddLastSelectionCommand(view).run(None)
+      duration = time.perf_counter() - start
+    else:
+      continue
+
+    latencies.setdefault(event, []).append(duration * 1000)
+
+    helpers = [plugin.Helper.getOrConstructHelperForView(view) for view in views.values()]
+    peakMemory = max(peakMemory, historyMemory(helpers))
+    peakEntries = max(peakEntries, sum(len(helper.lastSelections) for helper in helpers))
+
+  print("{0:<20}{1:>8}{2:>11}{3:>11}{4:>11}{5:>11}".format("event", "count", "p50 ms", "p95 ms", "p99 ms", "max ms"))
+  for event, durations in sorted(latencies.items()):
+    durations.sort()
+    print("{0:<20}{1:>8}{2:>11.3f}{3:>11.3f}{4:>11.3f}{5:>11.3f}".format(
+      event,
+      len(durations),
+      percentile(durations, 0.5),
+      percentile(durations, 0.95),
+      percentile(durations, 0.99),
+      durations[-1]
+    ))
+
+  print()
+  print("peak history: {0} entries, {1:.1f} KB".format(peakEntries, peakMemory / 1024.0))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,174 @@
+# A minimal stand-in for the sublime module, so that the plugin modules can be
+# imported and driven by the benchmarks outside of Sublime Text. Only the parts
+# of the API which the benchmarks reach are implemented: the imports and
+# plugin_loaded (bench_startup.py), Region (bench_region_array.py) and views
+# with a selection (replay_selection_trace.py).
+
+import os
+import tempfile
+
+
+DRAW_EMPTY = 1
+DRAW_OUTLINED = 256
+DRAW_NO_FILL = 32
+
+_settings = {}
+_nextViewId = [1]
+
+
+def version():
+
+  return "4000"
+
+
+def cache_path():
+
+  return os.path.join(tempfile.gettempdir(), "MultiEditUtilsBenchmarks")
+
+
+def load_settings(name):
+
+  if name not in _settings:
+    _settings[name] = Settings()
+
+  return _settings[name]
+
+
+def active_window():
+
+  return _window
+
+
+
+class Settings:
+
+  def __init__(self):
+
+    self.values = {}
+
+
+  def get(self, key, default=None):
+
+    return self.values.get(key, default)
+
+
+  def add_on_change(self, tag, callback):
+
+    pass
+
+
+
+class Region:
+
+  __slots__ = ["a", "b"]
+
+  def __init__(self, a, b=None):
+
+    self.a = a
+    self.b = a if b is None else b
+
+
+  def __repr__(self):
+
+    return "({0}, {1})".format(self.a, self.b)
+
+
+  def __len__(self):
+
+    return abs(self.a - self.b)
+
+
+  def begin(self):
+
+    return min(self.a, self.b)
+
+
+  def end(self):
+
+    return max(self.a, self.b)
+
+
+  def contains(self, x):
+
+    if isinstance(x, Region):
+      return self.begin() <= x.begin() and x.end() <= self.end()
+
+    return self.begin() <= x <= self.end()
+
+
+
+class Selection:
+
+  # The regions are kept sorted, the callers only add regions which don't
+  # overlap the selection.
+  def __init__(self):
+
+    self.regions = []
+
+
+  def __len__(self):
+
+    return len(self.regions)
+
+
+  def __getitem__(self, index):
+
+    return self.regions[index]
+
+
+  def __iter__(self):
+
+    return iter(self.regions)
+
+
+  def clear(self):
+
+    self.regions = []
+
+
+  def add(self, region):
+
+    self.add_all([region])
+
+
+  def add_all(self, regions):
+
+    self.regions.extend(regions)
+    self.regions.sort(key=Region.begin)
+
+
+  def contains(self, region):
+
+    return any(other.contains(region) for other in self.regions)
+
+
+
+class View:
+
+  def __init__(self):
+
+    self.viewId = _nextViewId[0]
+    _nextViewId[0] += 1
+    self.selection = Selection()
+
+
+  def id(self):
+
+    return self.viewId
+
+
+  def sel(self):
+
+    return self.selection
+
+
+
+class Window:
+
+  def new_file(self):
+
+    return View()
+
+
+
+_window = Window()
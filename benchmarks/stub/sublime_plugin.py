@@ -0,0 +1,23 @@
+# A minimal stand-in for the sublime_plugin module, see sublime.py.
+
+
+
+class WindowCommand:
+
+  def __init__(self, window):
+
+    self.window = window
+
+
+
+class TextCommand:
+
+  def __init__(self, view):
+
+    self.view = view
+
+
+
+class EventListener:
+
+  pass
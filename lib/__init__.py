@@ -0,0 +1,62 @@
+import importlib
+import sys
+
+
+# The modules of this package are not loaded as plugins. They are only
+# imported on first use via load, so that loading the plugins stays cheap.
+
+def load(name):
+
+  # the lookup of a loaded module is on hot paths like the settings
+  module = sys.modules.get(__name__ + "." + name)
+  if module is None:
+    module = importlib.import_module("." + name, __name__)
+
+  return module
+
+
+def loaded(name):
+
+  # the module if it was already imported, otherwise None
+  return sys.modules.get(__name__ + "." + name)
+
+
+def reloadModules():
+
+  # Sublime Text only reloads the plugins, e.g. after an upgrade of the
+  # package. The loaded modules of this package are dropped instead, so that
+  # their next load imports them again.
+  prefix = __name__ + "."
+  for name in [name for name in sys.modules if name.startswith(prefix)]:
+    del sys.modules[name]
+
+
+# the commands and event listeners for the profiling by module and class name
+_instrumented = {}
+
+
+def instrument(cls):
+
+  # Register a command or event listener for the profiling. The classes are
+  # only instrumented by lib.profiling once the profiling is enabled, so that
+  # it isn't loaded otherwise, see instrumentAll.
+  _instrumented[cls.__module__ + "." + cls.__name__] = cls
+  return cls
+
+
+def instrumentAll(force=False):
+
+  # Instrument the registered classes, if the profiling is enabled or forced
+  # for profiling a single command. This is called by plugin_loaded and
+  # whenever the settings change.
+  if force or load("settings").get("profiling", False):
+    profiling = load("profiling")
+    for cls in _instrumented.values():
+      profiling.instrument(cls)
+
+
+def follow(callback):
+
+  # see profiling.follow, there is nothing to follow without the profiling
+  profiling = loaded("profiling")
+  return callback if profiling is None else profiling.follow(callback)
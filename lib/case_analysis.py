@@ -0,0 +1,153 @@
+import re
+from array import array
+from collections import namedtuple
+
+
+Case = namedtuple("Case", "lower upper capitalized mixed")(1, 2, 3, 4)
+StringMetaData = namedtuple("StringMetaData", "separator cases stringGroups")
+
+lowerReg = re.compile("^[^A-Z]*$")
+upperReg = re.compile("^[^a-z]*$")
+capitalizedReg = re.compile("^[A-Z]([^A-Z])*$")
+
+
+def analyzeString(aString):
+
+  separators = "-_/. "
+  counts = list(map(lambda sep: aString.count(sep), separators))
+  maxCounts = max(counts)
+
+  if max(counts) > 0:
+    separator = separators[counts.index(maxCounts)]
+    stringGroups = aString.split(separator)
+  else:
+    # no real separator
+    separator = ""
+    stringGroups = splitByCase(aString)
+
+  cases = list(map(analyzeCase, stringGroups))
+
+  return StringMetaData(separator, cases, stringGroups)
+
+
+def splitByCase(aString):
+
+  # split at the change from lower to upper case (or vice versa)
+  # groups = re.split('(?<!^)((?:[^A-Z][A-Z])|(?:[A-Z]{2,}[^A-Z]))', aString)
+  groups = re.split('(?<!^)((?:[^A-Z][^a-z])|(?:[^a-z][^A-Z]))', aString)
+  newGroups = [groups[0]]
+  for index, group in enumerate(groups):
+    if index % 2 == 1:
+      newGroups[-1] += group[0:-1]
+      newGroups.append(group[-1] + groups[index + 1])
+
+  return newGroups
+
+
+def analyzeCase(aString):
+
+  if lowerReg.match(aString):
+    return Case.lower
+  elif upperReg.match(aString):
+    return Case.upper
+  elif capitalizedReg.match(aString):
+    return Case.capitalized
+  else:
+    return Case.mixed
+
+
+def replaceStringWithCase(oldString, newStringGroups):
+
+  analyzedOldString = analyzeString(oldString)
+  oldCases = analyzedOldString.cases
+  oldSeparator = analyzedOldString.separator
+
+  for index, currentElement in enumerate(newStringGroups):
+    # If the user provides more new strings than old ones are given, we just
+    # repeat the last case.
+    clampedIndex = min(index, len(oldCases) - 1)
+    currentCase = oldCases[clampedIndex]
+
+    if currentCase == Case.upper:
+      newStringGroups[index] = currentElement.upper()
+    elif currentCase == Case.lower:
+      newStringGroups[index] = currentElement.lower()
+    elif currentCase == Case.capitalized:
+      newStringGroups[index] = currentElement.capitalize()
+
+  return oldSeparator.join(newStringGroups)
+
+
+# A variant of a key may only begin and end at a word boundary or at a change
+# from lower to upper case, so that "someUser" contains "user", but "superuser"
+# doesn't.
+variantStart = r"(?:(?<![^\W_])|(?<=[a-z0-9])(?=[A-Z]))"
+variantEnd = r"(?:(?![^\W_])|(?<=[a-z0-9])(?=[A-Z]))"
+
+
+def variantPattern(key):
+
+  # The groups of the key in any case, joined by an optional separator. The
+  # letters are matched case-insensitively by character classes, since the
+  # boundaries have to be case-sensitive.
+  groups = []
+  for group in analyzeString(key).stringGroups:
+    groups.append("".join(
+      "[{0}{1}]".format(re.escape(character.lower()), re.escape(character.upper()))
+      if character.lower() != character.upper() else re.escape(character)
+      for character in group
+    ))
+
+  return "[-_/. ]?".join(groups)
+
+
+def compileMapping(mapping):
+
+  # One pattern for all keys, which finds the case variants of all keys in a
+  # single pass. Longer keys come first, so that they win over their prefixes.
+  keys = sorted((key for key in mapping if key), key=len, reverse=True)
+  alternatives = []
+  newStringGroups = {}
+
+  for index, key in enumerate(keys):
+    name = "k{0}".format(index)
+    alternatives.append("(?P<{0}>{1})".format(name, variantPattern(key)))
+    newStringGroups[name] = analyzeString(mapping[key]).stringGroups
+
+  pattern = re.compile("{0}(?:{1}){2}".format(variantStart, "|".join(alternatives), variantEnd))
+  return pattern, newStringGroups
+
+
+def iterPlanReplacements(text, mapping):
+
+  # A generator for lib.scheduler, which yields its progress and returns the
+  # begins, ends and new strings of the occurrences of the keys in the text.
+  begins, ends, newStrings = array("q"), array("q"), []
+  if not any(mapping):
+    return begins, ends, newStrings
+
+  pattern, newStringGroups = compileMapping(mapping)
+
+  for index, match in enumerate(pattern.finditer(text)):
+    if index % 1000 == 0:
+      yield match.start() / len(text)
+
+    oldString = match.group()
+    # replaceStringWithCase changes the groups in place
+    newString = replaceStringWithCase(oldString, list(newStringGroups[match.lastgroup]))
+    if newString != oldString:
+      begins.append(match.start())
+      ends.append(match.end())
+      newStrings.append(newString)
+
+  return begins, ends, newStrings
+
+
+def planReplacements(text, mapping):
+
+  steps = iterPlanReplacements(text, mapping)
+  while True:
+    try:
+      next(steps)
+    except StopIteration as stop:
+      return stop.value
@@ -0,0 +1,200 @@
+import sublime
+import re
+from collections import OrderedDict
+
+from . import loaded
+from .region_array import RegionArray
+
+
+def findNeedlesInText(text, needles, case=True, selectedWords=None, wordSeparators=""):
+
+  # This works on a plain text snapshot and doesn't touch the sublime API, so
+  # that it can be run on a worker thread. It mirrors MultiFindAllCommand: every
+  # needle is searched separately and the word filter compares the surrounding
+  # word with the selected words.
+
+  matches = RegionArray()
+
+  for needle in needles:
+    if case:
+      start = text.find(needle)
+      while start != -1:
+        matches.append(start, start + len(needle))
+        start = text.find(needle, start + len(needle))
+    else:
+      # lowering the text could change its length, so use the regex engine
+      for match in re.finditer(re.escape(needle), text, re.IGNORECASE):
+        matches.append(*match.span())
+
+  if selectedWords is not None:
+    boundaries = set(wordSeparators) | set(" \t\r\n")
+    matches = matches.filter(lambda a, b: expandToWord(text, a, b, boundaries).lower() in selectedWords)
+
+  # The needles can match the same text, e.g. abc and ABC ignoring the case,
+  # or overlap like foo and foobar. The matches are merged, so that they are
+  # counted like the selection they result in.
+  return matches.merged()
+
+
+def expandToWord(text, a, b, boundaries):
+
+  while a > 0 and text[a - 1] not in boundaries:
+    a -= 1
+  while b < len(text) and text[b] not in boundaries:
+    b += 1
+
+  return text[a:b]
+
+
+
+def canOverlapItself(needle):
+
+  # whether two case insensitive matches of the needle can overlap, i.e. the
+  # needle begins with one of its suffixes
+  lowered = needle.lower()
+  if len(lowered) != len(needle):
+    return True
+
+  return any(lowered[:length] == lowered[-length:] for length in range(1, len(lowered)))
+
+
+
+class FindAllCache:
+
+  # The results of MultiFindAllCommand are cached per view until the buffer is
+  # modified. The matches are stored as RegionArrays, the cache size is limited by the number of entries and the number of matches.
+  viewToCacheMap = {}
+  maxEntries = 32
+  maxMatches = 1000000
+
+  def __init__(self):
+
+    self.changeCount = None
+    self.entries = OrderedDict()
+    self.matchCount = 0
+
+
+  @staticmethod
+  def getOrConstructCacheForView(view):
+
+    mapping = FindAllCache.viewToCacheMap
+    viewID = view.id()
+
+    if not viewID in mapping.keys():
+      mapping[viewID] = FindAllCache()
+
+    cache = mapping[viewID]
+    if cache.changeCount != view.change_count():
+      cache.clear()
+      cache.changeCount = view.change_count()
+
+    return cache
+
+
+  def clear(self):
+
+    self.entries.clear()
+    self.matchCount = 0
+
+
+  def get(self, key):
+
+    matches = self.entries.get(key)
+    if matches is not None:
+      self.entries.move_to_end(key)
+
+    return matches
+
+
+  def put(self, key, matches):
+
+    if key in self.entries:
+      self.matchCount -= len(self.entries.pop(key))
+
+    self.entries[key] = matches
+    self.matchCount += len(matches)
+
+    # evict the least recently used entries, but always keep the new one
+    while len(self.entries) > 1 and (
+      len(self.entries) > self.maxEntries or self.matchCount > self.maxMatches
+    ):
+      evictedKey, evicted = self.entries.popitem(last=False)
+      self.matchCount -= len(evicted)
+
+
+  def iterFindAll(self, view, needles, case, selectedWords, ignoreComments):
+
+    # A generator for lib.scheduler, which yields its progress and returns the
+    # matches. The cache is only updated once the search has finished.
+    needles = frozenset(needles)
+    key = (needles, case, selectedWords, ignoreComments)
+
+    matches = self.get(key)
+    if matches is not None:
+      return matches
+
+    # the filters only remove matches, so they can be applied to the
+    # unfiltered matches of the same needles
+    matches = yield from self.iterFindNeedles(view, needles, case)
+
+    if selectedWords is not None:
+      def isSelectedWord(a, b):
+        return view.substr(view.word(sublime.Region(a, b))).lower() in selectedWords
+
+      matches = yield from self.iterFilterMatches(matches, isSelectedWord)
+
+    if ignoreComments:
+      def isNoComment(a, b):
+        return not re.search(r'\bcomment\b', view.scope_name(a))
+
+      matches = yield from self.iterFilterMatches(matches, isNoComment)
+
+    self.put(key, matches)
+    return matches
+
+
+  def iterFindNeedles(self, view, needles, case):
+
+    key = (needles, case, None, False)
+
+    matches = self.get(key)
+    if matches is not None:
+      return matches
+
+    insensitiveMatches = self.get((needles, False, None, False))
+
+    if case and insensitiveMatches is not None and not any(map(canOverlapItself, needles)):
+      # The case sensitive matches are a subset of the case insensitive ones,
+      # unless a needle can overlap itself: in "Aaa" the case insensitive
+      # match "Aa" of the needle "aa" hides the case sensitive match "aa".
+      text = view.substr(sublime.Region(0, view.size()))
+      matches = yield from self.iterFilterMatches(insensitiveMatches, lambda a, b: text[a:b] in needles)
+    else:
+      flags = sublime.LITERAL if case else sublime.LITERAL | sublime.IGNORECASE
+      trigramIndex = loaded("trigram_index")
+      index = trigramIndex.get(view) if trigramIndex is not None else None
+      matches = RegionArray()
+      for needleIndex, needle in enumerate(needles):
+        yield needleIndex / len(needles)
+        # the index only finds the candidate blocks of longer needles
+        indexedMatches = index.findAll(view, needle, case) if index is not None else None
+        if indexedMatches is not None:
+          matches.extend(indexedMatches)
+          continue
+
+        matches.extend(RegionArray.fromRegions(view.find_all(needle, flags)))
+
+    self.put(key, matches)
+    return matches
+
+
+  def iterFilterMatches(self, matches, condition):
+
+    filteredMatches = RegionArray()
+    for index, (a, b) in enumerate(matches):
+      if index % 1000 == 0:
+        yield index / len(matches)
+      if condition(a, b):
+        filteredMatches.append(a, b)
+
+    return filteredMatches
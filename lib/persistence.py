@@ -0,0 +1,193 @@
+import sublime
+import hashlib
+import mmap
+import os
+import sys
+from array import array
+from collections import OrderedDict
+
+from .region_array import RegionArray
+
+
+# The selection state of a file is stored in a compact binary format:
+#
+#   magic | sha1 of the buffer content | length of the section names | names | data
+#
+# The sections map names to lists of RegionArrays, the groups. The data is a
+# flat array of 64 bit integers. For every section it contains the number of
+# groups and for every group its length followed by the columns of the
+# RegionArray. Only the header has to be read to detect a stale file.
+MAGIC = b"MEU2" + (b"l" if sys.byteorder == "little" else b"b")
+HASH_SIZE = 20
+HEADER_SIZE = len(MAGIC) + HASH_SIZE + 8
+
+# larger files are memory-mapped instead of read
+MMAP_THRESHOLD = 1 << 20
+
+
+# the last content hash per view id, together with the change count
+_contentHashes = {}
+
+
+def contentHash(view):
+
+  changeCount = view.change_count()
+  cached = _contentHashes.get(view.id())
+  if cached is not None and cached[0] == changeCount:
+    return cached[1]
+
+  text = view.substr(sublime.Region(0, view.size()))
+  digest = hashlib.sha1(text.encode("utf-8")).digest()
+  _contentHashes[view.id()] = (changeCount, digest)
+
+  return digest
+
+
+def cachedHash(view):
+
+  # The content hash of the last save or load, if the buffer wasn't modified
+  # since then. This is used on close, where hashing would block the UI.
+  cached = _contentHashes.get(view.id())
+  if cached is None or cached[0] != view.change_count():
+    return None
+
+  return cached[1]
+
+
+def forgetView(view):
+
+  _contentHashes.pop(view.id(), None)
+
+
+def statePath(fileName, kind):
+
+  name = hashlib.sha1(fileName.encode("utf-8")).hexdigest()
+  return os.path.join(sublime.cache_path(), "MultiEditUtils", "selections", name + "." + kind)
+
+
+def save(view, kind, sections, onClose=False):
+
+  # Save the sections of a kind of state, e.g. "fields", to be restored with
+  # the file, see load. Without sections the saved state is removed. A dirty
+  # buffer doesn't match the file anymore, the state which was saved with the
+  # file stays valid.
+  if not view.file_name() or view.is_dirty():
+    return
+
+  path = statePath(view.file_name(), kind)
+  if not sections:
+    remove(path)
+    return
+
+  # The buffer isn't hashed in the UI thread on close. Without the hash of the
+  # last save or load, the state saved with the file is kept.
+  digest = cachedHash(view) if onClose else contentHash(view)
+  if digest is not None:
+    writeState(path, digest, sections)
+
+
+def load(view, kind, onLoaded):
+
+  # Read the saved sections of a kind of state and pass them to onLoaded on the
+  # main thread, unless the buffer was modified in the meantime. This is called
+  # in the async thread, the buffer is only hashed if a state was saved.
+  if not view.file_name():
+    return
+
+  path = statePath(view.file_name(), kind)
+  if not os.path.isfile(path):
+    return
+
+  changeCount = view.change_count()
+  sections = readState(path, contentHash(view))
+  if sections is None:
+    # the file was changed since the state was saved
+    remove(path)
+    return
+
+  def restore():
+    if view.is_valid() and view.change_count() == changeCount:
+      onLoaded(sections)
+
+  sublime.set_timeout(restore, 0)
+
+
+def writeState(path, digest, sections):
+
+  data = array("q")
+  for groups in sections.values():
+    data.append(len(groups))
+    for group in groups:
+      data.append(len(group))
+      data.extend(group.a)
+      data.extend(group.b)
+
+  names = "\n".join(sections.keys()).encode("utf-8")
+
+  directory = os.path.dirname(path)
+  if not os.path.isdir(directory):
+    os.makedirs(directory)
+
+  # write to a temporary file first, so that a crash can't leave a broken file
+  temporaryPath = path + ".tmp"
+  with open(temporaryPath, "wb") as stateFile:
+    stateFile.write(MAGIC)
+    stateFile.write(digest)
+    stateFile.write(array("q", [len(names)]).tobytes())
+    stateFile.write(names)
+    stateFile.write(data.tobytes())
+
+  os.replace(temporaryPath, path)
+
+
+def readState(path, digest):
+
+  # Returns the sections or None if the file doesn't exist or was written
+  # for a different content.
+  if not os.path.isfile(path):
+    return None
+
+  with open(path, "rb") as stateFile:
+    header = stateFile.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE or header[:len(MAGIC)] != MAGIC:
+      return None
+    if header[len(MAGIC):len(MAGIC) + HASH_SIZE] != digest:
+      return None
+
+    nameLength = array("q", header[-8:])[0]
+    fileSize = os.fstat(stateFile.fileno()).st_size
+
+    if fileSize > MMAP_THRESHOLD:
+      content = mmap.mmap(stateFile.fileno(), 0, access=mmap.ACCESS_READ)
+    else:
+      content = header + stateFile.read()
+
+    try:
+      names = content[HEADER_SIZE:HEADER_SIZE + nameLength].decode("utf-8")
+      data = array("q")
+      data.frombytes(content[HEADER_SIZE + nameLength:])
+    finally:
+      if isinstance(content, mmap.mmap):
+        content.close()
+
+  sections = OrderedDict()
+  position = 0
+  for name in names.split("\n") if names else []:
+    groups = []
+    groupCount = data[position]
+    position += 1
+    for _ in range(groupCount):
+      length = data[position]
+      start = position + 1
+      groups.append(RegionArray(data[start:start + length], data[start + length:start + 2 * length]))
+      position = start + 2 * length
+    sections[name] = groups
+
+  return sections
+
+
+def remove(path):
+
+  if os.path.isfile(path):
+    os.remove(path)
+
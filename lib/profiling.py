@@ -0,0 +1,415 @@
+import sublime, sublime_plugin
+import os
+import threading
+import time
+from collections import deque, OrderedDict
+from functools import wraps
+
+from . import settings
+
+
+# The profiling is opt-in via the "profiling" setting. While it is disabled the
+# instrumented methods only pay for a flag check.
+_enabled = None
+_events = deque(maxlen=10000)
+
+# whether the next command should be run under cProfile, see profileNextCommand
+_profileNext = False
+# the label of the call, which is run under cProfile, and whether it handed
+# the profile over to a callback, see follow
+_profiledLabel = None
+_followed = False
+
+# the counted api calls, see CountingView
+_counters = ["substr", "find_all", "sel_add", "sel_add_all"]
+# The api calls are counted on the views, which are passed to the
+# instrumented calls, and only while a thread runs an instrumented call. The
+# counts are kept per thread.
+_threadState = threading.local()
+
+
+def isEnabled():
+
+  global _enabled, _events
+
+  if _enabled is None:
+    _enabled = bool(settings.get("profiling", False))
+
+    bufferSize = settings.get("profiling_buffer_size", 10000)
+    if _events.maxlen != bufferSize:
+      _events = deque(_events, maxlen=bufferSize)
+
+  return _enabled
+
+
+def onSettingsChanged():
+
+  global _enabled
+  _enabled = None
+
+
+settings.addListener(onSettingsChanged)
+
+
+def unload():
+
+  # this module isn't reloaded with the plugins, the setting is read again
+  global _enabled
+  _enabled = None
+
+
+def countCall(counter):
+
+  counts = getattr(_threadState, "counts", None)
+  if counts is not None:
+    counts[counter] += 1
+
+
+
+class CountingView:
+
+  # Wraps the view of an instrumented call and counts the api calls made on
+  # it, the other packages and views are not affected.
+  def __init__(self, view):
+
+    self.view = view
+
+
+  def __getattr__(self, name):
+
+    return getattr(self.view, name)
+
+
+  def __eq__(self, other):
+
+    return other is not None and self.view.id() == other.id()
+
+
+  def __ne__(self, other):
+
+    return not self == other
+
+
+  def __hash__(self):
+
+    return hash(self.view.id())
+
+
+  def substr(self, x):
+
+    countCall("substr")
+    return self.view.substr(x)
+
+
+  def find_all(self, *args, **kwargs):
+
+    countCall("find_all")
+    return self.view.find_all(*args, **kwargs)
+
+
+  def sel(self):
+
+    return CountingSelection(self.view.sel())
+
+
+
+class CountingSelection:
+
+  def __init__(self, selection):
+
+    self.selection = selection
+
+
+  def __getattr__(self, name):
+
+    return getattr(self.selection, name)
+
+
+  def __len__(self):
+
+    return len(self.selection)
+
+
+  def __getitem__(self, index):
+
+    return self.selection[index]
+
+
+  def __iter__(self):
+
+    return iter(self.selection)
+
+
+  def __eq__(self, other):
+
+    return self.selection == getattr(other, "selection", other)
+
+
+  def __ne__(self, other):
+
+    return not self == other
+
+
+  def add(self, region):
+
+    countCall("sel_add")
+    return self.selection.add(region)
+
+
+  def add_all(self, regions):
+
+    countCall("sel_add_all")
+    return self.selection.add_all(regions)
+
+
+
+def instrument(cls):
+
+  # Wrap the run method of commands and the hooks of event listeners.
+  # on_query_context is left out, it is called for the context keys of every
+  # keybinding and would evict the other events from the buffer.
+  isCommand = not issubclass(cls, sublime_plugin.EventListener)
+  if isCommand:
+    names = ["run"]
+  else:
+    names = [name for name in cls.__dict__
+             if name.startswith("on_") and name != "on_query_context"]
+
+  for name in names:
+    method = cls.__dict__.get(name)
+    if method is None:
+      continue
+    # the classes are instrumented again, e.g. whenever the settings change or
+    # by a reloaded version of this module
+    if hasattr(method, "timedLabel"):
+      method = method.__wrapped__
+    setattr(cls, name, timed(method, "{0}.{1}".format(cls.__name__, name), isCommand))
+
+  return cls
+
+
+def timed(method, label, isCommand):
+
+  @wraps(method)
+  def wrapper(self, *args, **kwargs):
+
+    if _profileNext and isCommand:
+      return profileCall(label, method, self, args, kwargs)
+
+    if not isEnabled():
+      return method(self, *args, **kwargs)
+
+    view = findView(self, args)
+    regionsIn = len(view.sel()) if view is not None else -1
+
+    # the counts of the api calls are taken on the view of the call, which is
+    # either the view of the command or the first argument of the hook
+    countingView = None
+    if view is not None and getattr(self, "view", None) is view:
+      countingView = self.view = CountingView(view)
+    elif view is not None and args and args[0] is view:
+      countingView = CountingView(view)
+      args = (countingView,) + tuple(args[1:])
+
+    # nested instrumented calls share the counts of the outermost one
+    counts = getattr(_threadState, "counts", None)
+    isOutermost = counts is None
+    if isOutermost:
+      counts = _threadState.counts = dict((counter, 0) for counter in _counters)
+    callCounts = dict(counts)
+    start = time.perf_counter()
+
+    try:
+      return method(self, *args, **kwargs)
+    finally:
+      duration = time.perf_counter() - start
+      if isOutermost:
+        _threadState.counts = None
+      if countingView is not None and getattr(self, "view", None) is countingView:
+        self.view = view
+
+      regionsOut, bufferSize = -1, -1
+      if view is not None and view.is_valid():
+        regionsOut = len(view.sel())
+        bufferSize = view.size()
+
+      _events.append((
+        label,
+        duration,
+        regionsIn,
+        regionsOut,
+        bufferSize,
+        tuple(counts[counter] - callCounts[counter] for counter in _counters)
+      ))
+
+  wrapper.timedLabel = label
+  return wrapper
+
+
+def profileNextCommand():
+
+  global _profileNext
+  _profileNext = True
+
+
+def follow(callback):
+
+  # Commands which ask for input pass the callback of the input panel through
+  # this. While such a command is profiled, its call only opens the panel, so
+  # the profile is taken of the first call of the callback instead.
+  global _followed
+  if _profiledLabel is None:
+    return callback
+
+  _followed = True
+  label = _profiledLabel
+  pending = [True]
+
+  @wraps(callback)
+  def wrapper(*args, **kwargs):
+    if not pending[0]:
+      return callback(*args, **kwargs)
+
+    pending[0] = False
+    return profileCall(label, callback, None, args, kwargs)
+
+  return wrapper
+
+
+def profileCall(label, method, instance, args, kwargs):
+
+  # Run a single command under cProfile and write the raw stats as .pstats
+  # file and a summary sorted by the cumulative time next to it. instance is
+  # None for callbacks, see follow.
+  import cProfile
+
+  global _profileNext, _profiledLabel, _followed
+  _profileNext = False
+  _profiledLabel = label
+  _followed = False
+
+  if instance is not None:
+    args = (instance,) + tuple(args)
+
+  profile = cProfile.Profile()
+  try:
+    return profile.runcall(method, *args, **kwargs)
+  finally:
+    _profiledLabel = None
+    if not _followed:
+      writeProfile(label, profile)
+
+
+def writeProfile(label, profile):
+
+  import io
+  import pstats
+
+  basePath = os.path.join(
+    outputDirectory("profiles"),
+    "{0}-{1}".format(label, time.strftime("%Y%m%d-%H%M%S"))
+  )
+  profile.dump_stats(basePath + ".pstats")
+
+  summary = io.StringIO()
+  stats = pstats.Stats(profile, stream=summary)
+  stats.sort_stats("cumulative").print_stats(50)
+
+  with open(basePath + ".txt", "w") as summaryFile:
+    summaryFile.write(summary.getvalue())
+
+  sublime.set_timeout(lambda: showProfile(basePath), 0)
+
+
+def showProfile(basePath):
+
+  sublime.status_message("MultiEditUtils: profile written to {0}.pstats".format(basePath))
+  sublime.active_window().open_file(basePath + ".txt")
+
+
+def outputDirectory(*names):
+
+  directory = os.path.join(sublime.cache_path(), "MultiEditUtils", *names)
+  if not os.path.isdir(directory):
+    os.makedirs(directory)
+
+  return directory
+
+
+def findView(instance, args):
+
+  view = getattr(instance, "view", None)
+  if view is None and hasattr(instance, "window"):
+    view = instance.window.active_view()
+  if view is None and args and isinstance(args[0], sublime.View):
+    view = args[0]
+
+  return view
+
+
+def clear():
+
+  _events.clear()
+
+
+def percentile(sortedValues, fraction):
+
+  # nearest-rank percentile
+  import math
+  index = max(0, int(math.ceil(fraction * len(sortedValues))) - 1)
+  return sortedValues[index]
+
+
+def summarize():
+
+  eventsByLabel = OrderedDict()
+  for event in _events:
+    eventsByLabel.setdefault(event[0], []).append(event)
+
+  stats = []
+  for label, events in eventsByLabel.items():
+    durations = sorted(event[1] * 1000 for event in events)
+    count = len(events)
+    stat = OrderedDict([
+      ("name", label),
+      ("count", count),
+      ("total_ms", sum(durations)),
+      ("p50_ms", percentile(durations, 0.5)),
+      ("p95_ms", percentile(durations, 0.95)),
+      ("p99_ms", percentile(durations, 0.99)),
+      ("max_ms", durations[-1]),
+      ("regions_in", max(event[2] for event in events)),
+      ("regions_out", max(event[3] for event in events)),
+      ("buffer_size", max(event[4] for event in events)),
+    ])
+    for index, counter in enumerate(_counters):
+      stat[counter] = sum(event[5][index] for event in events) / float(count)
+    stats.append(stat)
+
+  stats.sort(key=lambda stat: stat["total_ms"], reverse=True)
+  return stats
+
+
+def formatStats(stats):
+
+  # regions and buffer size are the maximum, the api calls the mean per call
+  columns = ["count", "p50_ms", "p95_ms", "p99_ms", "max_ms", "regions_in",
+             "regions_out", "buffer_size"] + _counters
+  nameWidth = max([len("name")] + [len(stat["name"]) for stat in stats])
+
+  lines = ["name".ljust(nameWidth) + "".join(column.rjust(13) for column in columns)]
+  for stat in stats:
+    cells = []
+    for column in columns:
+      value = stat[column]
+      cells.append(("{0:.2f}".format(value) if isinstance(value, float) else str(value)).rjust(13))
+    lines.append(stat["name"].ljust(nameWidth) + "".join(cells))
+
+  return "\n".join(lines) + "\n"
+
+
+def writeStats(stats, path):
+
+  import json
+  with open(path, "w") as statsFile:
+    json.dump(stats, statsFile, indent=2)
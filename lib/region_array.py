@@ -0,0 +1,181 @@
+import sublime
+from array import array
+from bisect import bisect_right
+
+
+# A list of regions stored in two columns of 64 bit integers instead of one
+# Region object per region. The commands convert the selection into a
+# RegionArray once, work on the columns and only create Region objects again
+# when they pass the regions back to the API (see toRegions).
+
+class RegionArray:
+
+  __slots__ = ["a", "b"]
+
+  def __init__(self, a=None, b=None):
+
+    self.a = array("q") if a is None else a
+    self.b = array("q") if b is None else b
+
+
+  @staticmethod
+  def fromRegions(regions):
+
+    a, b = array("q"), array("q")
+    for region in regions:
+      a.append(region.a)
+      b.append(region.b)
+
+    return RegionArray(a, b)
+
+
+  def toRegions(self):
+
+    Region = sublime.Region
+    return [Region(a, b) for a, b in zip(self.a, self.b)]
+
+
+  def __len__(self):
+
+    return len(self.a)
+
+
+  def __iter__(self):
+
+    return zip(self.a, self.b)
+
+
+  def __getitem__(self, index):
+
+    if isinstance(index, slice):
+      return RegionArray(self.a[index], self.b[index])
+
+    return (self.a[index], self.b[index])
+
+
+  def __eq__(self, other):
+
+    return isinstance(other, RegionArray) and self.a == other.a and self.b == other.b
+
+
+  def append(self, a, b):
+
+    self.a.append(a)
+    self.b.append(b)
+
+
+  def extend(self, other):
+
+    self.a.extend(other.a)
+    self.b.extend(other.b)
+
+
+  def region(self, index):
+
+    return sublime.Region(self.a[index], self.b[index])
+
+
+  def begins(self):
+
+    return array("q", map(min, self.a, self.b))
+
+
+  def ends(self):
+
+    return array("q", map(max, self.a, self.b))
+
+
+  def sizes(self):
+
+    return array("q", (abs(a - b) for a, b in zip(self.a, self.b)))
+
+
+  def normalized(self):
+
+    # the same regions, but each one from its begin to its end
+    return RegionArray(self.begins(), self.ends())
+
+
+  def isSorted(self):
+
+    begins = self.begins()
+    return all(begins[i] <= begins[i + 1] for i in range(len(begins) - 1))
+
+
+  def sorted(self):
+
+    # sorted by begin and end, the direction of the regions is kept
+    # a single integer per region compares much faster than a tuple
+    ends = self.ends()
+    scale = max(ends) + 1 if ends else 1
+    keys = [begin * scale + end for begin, end in zip(self.begins(), ends)]
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    a, b = self.a, self.b
+    return RegionArray(array("q", [a[i] for i in order]), array("q", [b[i] for i in order]))
+
+
+  def merged(self, tolerance=None):
+
+    # Sort the regions and merge overlapping ones in a single sweep. Without a
+    # tolerance, touching regions are kept apart like in the selection and only
+    # duplicate cursors are merged. Otherwise regions which are at most
+    # tolerance characters apart are merged as well. Merged regions are
+    # forward, the other ones keep their direction.
+    regions = self if self.isSorted() else self.sorted()
+    resultA, resultB = array("q"), array("q")
+    lastBegin = lastEnd = None
+
+    for a, b in zip(regions.a, regions.b):
+      begin, end = (a, b) if a <= b else (b, a)
+
+      if lastEnd is not None and (
+        begin < lastEnd or
+        (begin == lastBegin and end == lastEnd) or
+        (tolerance is not None and begin - lastEnd <= tolerance)
+      ):
+        lastEnd = max(lastEnd, end)
+        resultA[-1] = lastBegin
+        resultB[-1] = lastEnd
+        continue
+
+      resultA.append(a)
+      resultB.append(b)
+      lastBegin, lastEnd = begin, end
+
+    return RegionArray(resultA, resultB)
+
+
+  def contains(self, a, b=None):
+
+    # Whether a point or a region lies within one of the regions. The regions
+    # have to be forward, sorted and must not overlap, e.g. the result of
+    # merged().normalized().
+    if b is None:
+      b = a
+    begin, end = min(a, b), max(a, b)
+
+    index = bisect_right(self.a, begin) - 1
+    return index >= 0 and end <= self.b[index]
+
+
+  def map(self, function):
+
+    # a new RegionArray with function(a, b) applied to every region
+    resultA, resultB = array("q"), array("q")
+    for a, b in zip(self.a, self.b):
+      a, b = function(a, b)
+      resultA.append(a)
+      resultB.append(b)
+
+    return RegionArray(resultA, resultB)
+
+
+  def filter(self, condition):
+
+    resultA, resultB = array("q"), array("q")
+    for a, b in zip(self.a, self.b):
+      if condition(a, b):
+        resultA.append(a)
+        resultB.append(b)
+
+    return RegionArray(resultA, resultB)
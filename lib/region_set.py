@@ -0,0 +1,122 @@
+from .region_array import RegionArray
+
+
+# Set operations on regions, which are given as RegionArrays. The
+# operations expect canonical sets, i.e. forward regions which are sorted and
+# don't overlap (see canonicalize), and run in linear time. A cursor counts as
+# contained in a region if it lies within or at the border of the region.
+
+
+def appendRegion(regions, begin, end):
+
+  # append a region to a canonical set, merging it with the last region if
+  # they overlap or if one of them is a cursor at the same position
+  if regions.a:
+    lastBegin, lastEnd = regions.a[-1], regions.b[-1]
+    if begin < lastEnd or (begin == lastBegin and (lastBegin == lastEnd or begin == end)):
+      regions.b[-1] = max(lastEnd, end)
+      return
+
+  regions.append(begin, end)
+
+
+def canonicalize(regions):
+
+  result = RegionArray()
+  normalized = regions.normalized()
+  for begin, end in sorted(zip(normalized.a, normalized.b)):
+    appendRegion(result, begin, end)
+
+  return result
+
+
+def union(regionsA, regionsB):
+
+  result = RegionArray()
+  beginsA, endsA, beginsB, endsB = regionsA.a, regionsA.b, regionsB.a, regionsB.b
+  indexA, indexB = 0, 0
+  lengthA, lengthB = len(beginsA), len(beginsB)
+
+  while indexA < lengthA or indexB < lengthB:
+    takeA = indexB >= lengthB or (
+      indexA < lengthA and
+      (beginsA[indexA], endsA[indexA]) <= (beginsB[indexB], endsB[indexB])
+    )
+
+    if takeA:
+      appendRegion(result, beginsA[indexA], endsA[indexA])
+      indexA += 1
+    else:
+      appendRegion(result, beginsB[indexB], endsB[indexB])
+      indexB += 1
+
+  return result
+
+
+def intersect(regionsA, regionsB):
+
+  result = RegionArray()
+  beginsB, endsB = regionsB.a, regionsB.b
+  indexB = 0
+  lengthB = len(beginsB)
+
+  for begin, end in regionsA:
+    # skip the regions of B which end before this region
+    while indexB < lengthB and endsB[indexB] < begin:
+      indexB += 1
+
+    current = indexB
+    while current < lengthB and beginsB[current] <= end:
+      beginB, endB = beginsB[current], endsB[current]
+      current += 1
+
+      if begin == end:
+        if beginB <= begin <= endB:
+          appendRegion(result, begin, end)
+          break
+      elif beginB == endB:
+        appendRegion(result, beginB, endB)
+      elif max(begin, beginB) < min(end, endB):
+        appendRegion(result, max(begin, beginB), min(end, endB))
+
+  return result
+
+
+def subtract(regionsA, regionsB):
+
+  result = RegionArray()
+  beginsB, endsB = regionsB.a, regionsB.b
+  indexB = 0
+  lengthB = len(beginsB)
+
+  for begin, end in regionsA:
+    # skip the regions of B which end before this region
+    while indexB < lengthB and endsB[indexB] < begin:
+      indexB += 1
+
+    current = indexB
+
+    if begin == end:
+      # a cursor is removed if it is contained in a region of B
+      while current < lengthB and beginsB[current] <= begin:
+        if begin <= endsB[current]:
+          break
+        current += 1
+      else:
+        appendRegion(result, begin, end)
+      continue
+
+    # cut the regions of B out of the region, cursors of B don't remove anything
+    while current < lengthB and beginsB[current] < end:
+      beginB, endB = beginsB[current], endsB[current]
+      current += 1
+
+      if beginB < endB and endB > begin:
+        if beginB > begin:
+          appendRegion(result, begin, beginB)
+        begin = endB
+
+    if begin < end:
+      appendRegion(result, begin, end)
+
+  return result
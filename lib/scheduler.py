@@ -0,0 +1,111 @@
+import sublime
+import time
+
+
+# Long running operations are written as generators, which yield their progress
+# as a fraction from time to time and return their result. The scheduler runs
+# them in slices of a few milliseconds via set_timeout, so that Sublime stays
+# responsive, and shows the progress in the status bar. The result is only
+# applied when the generator has finished, so a cancelled operation doesn't
+# leave anything behind. The first slice runs right away, hence operations
+# which finish within it are applied synchronously.
+
+sliceDuration = 0.008
+
+# the running task per view id
+_tasks = {}
+
+
+class Task:
+
+  def __init__(self, view, label, generator, onDone):
+
+    self.view = view
+    self.label = label
+    self.generator = generator
+    self.onDone = onDone
+    self.changeCount = view.change_count()
+    self.cancelled = False
+    self.progress = 0.0
+
+
+  def step(self):
+
+    # a finished, cancelled or replaced task doesn't run anymore
+    if self.cancelled or _tasks.get(self.view.id()) is not self:
+      return
+
+    view = self.view
+    if not view.is_valid() or view.change_count() != self.changeCount:
+      self.cancel("the file was modified")
+      return
+
+    deadline = time.perf_counter() + sliceDuration
+    try:
+      while True:
+        self.progress = next(self.generator)
+        if time.perf_counter() >= deadline:
+          break
+    except StopIteration as stop:
+      self.finish(stop.value)
+      return
+    except Exception:
+      # the status and the cancel keybinding must not stay behind
+      self.close()
+      raise
+
+    view.set_status("meu_task", "{0}: {1:.0%} (escape to cancel)".format(self.label, self.progress))
+    sublime.set_timeout(self.step, 0)
+
+
+  def finish(self, result):
+
+    self.close()
+    self.onDone(result)
+
+
+  def cancel(self, reason=None):
+
+    self.cancelled = True
+    self.generator.close()
+    self.close()
+
+    message = "{0}: cancelled".format(self.label)
+    if reason:
+      message += ", " + reason
+    sublime.status_message(message)
+
+
+  def close(self):
+
+    if _tasks.get(self.view.id()) is self:
+      del _tasks[self.view.id()]
+      self.view.erase_status("meu_task")
+
+
+
+def run(view, label, generator, onDone):
+
+  # Run the generator and pass its result to onDone. A running task of the view
+  # is cancelled, since its result would be applied to a different state.
+  cancel(view)
+
+  task = Task(view, label, generator, onDone)
+  _tasks[view.id()] = task
+  task.step()
+  return task
+
+
+def isRunning(view):
+
+  return view.id() in _tasks
+
+
+def cancel(view):
+
+  task = _tasks.get(view.id())
+  if task is None:
+    return False
+
+  task.cancel()
+  return True
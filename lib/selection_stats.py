@@ -0,0 +1,72 @@
+from collections import Counter, OrderedDict
+
+
+# Statistics of a selection for the selection_stats command. They are
+# collected in one pass over the regions, the texts are sliced from a single
+# substr of the selected span.
+
+def collect(regions, text, offset, top=10):
+
+  # regions is a RegionArray in the order of the selection, text the buffer
+  # from offset to the end of the last region
+  lengths = []
+  counts = Counter()
+  emptyCount = overlapCount = 0
+  lastEnd = None
+
+  for a, b in regions:
+    begin, end = (a, b) if a <= b else (b, a)
+    lengths.append(end - begin)
+    counts[text[begin - offset:end - offset]] += 1
+
+    if begin == end:
+      emptyCount += 1
+    if lastEnd is not None and begin < lastEnd:
+      overlapCount += 1
+    lastEnd = end if lastEnd is None else max(lastEnd, end)
+
+  lengths.sort()
+  count = len(lengths)
+
+  return OrderedDict([
+    ("regions", count),
+    ("empty", emptyCount),
+    ("overlapping", overlapCount),
+    ("total_length", sum(lengths)),
+    ("min_length", lengths[0] if count else 0),
+    ("max_length", lengths[-1] if count else 0),
+    ("median_length", median(lengths)),
+    ("distinct_texts", len(counts)),
+    ("top_texts", counts.most_common(top)),
+  ])
+
+
+def median(values):
+
+  # values must be sorted
+  count = len(values)
+  if not count:
+    return 0
+
+  middle = count // 2
+  if count % 2:
+    return values[middle]
+
+  return (values[middle - 1] + values[middle]) / 2.0
+
+
+def formatStats(stats, firstLine, lastLine):
+
+  lines = []
+  for key, value in stats.items():
+    if key != "top_texts":
+      lines.append("{0:<16}{1}".format(key, value))
+
+  lines.append("{0:<16}{1} - {2}".format("lines", firstLine, lastLine))
+  lines.append("")
+  lines.append("most common texts:")
+  for text, count in stats["top_texts"]:
+    # the texts are shown on one line
+    lines.append("{0:>8}  {1!r}".format(count, text))
+
+  return "\n".join(lines) + "\n"
@@ -0,0 +1,101 @@
+import sublime
+import json
+import os
+import threading
+import time
+
+from . import profiling
+
+
+# Records the selection changes and add_last_selection calls of a session to a
+# trace file, so that SelectionListener can be benchmarked on real editing
+# patterns (see benchmarks/replay_selection_trace.py). Every line of the file
+# is a JSON list [milliseconds, view id, event] followed by the delta encoded
+# endpoints of the selection for "selection" events. The lines are collected
+# in memory and appended to the file in the async thread.
+
+flushDelay = 1000
+
+_lines = []
+_lock = threading.Lock()
+_path = None
+_start = None
+_flushScheduled = False
+
+
+def record(view, event, selection=None):
+
+  global _path, _start, _flushScheduled
+
+  now = time.perf_counter()
+  if _start is None:
+    _start = now
+    _path = os.path.join(
+      profiling.outputDirectory("traces"),
+      time.strftime("selections-%Y%m%d-%H%M%S.trace")
+    )
+
+  entry = [round((now - _start) * 1000, 3), view.id(), event]
+  if selection is not None:
+    entry.append(deltaEncode(selection))
+  line = json.dumps(entry, separators=(",", ":"))
+
+  with _lock:
+    _lines.append(line)
+    if _flushScheduled:
+      return
+    _flushScheduled = True
+
+  sublime.set_timeout_async(flush, flushDelay)
+
+
+def flush():
+
+  global _flushScheduled
+
+  with _lock:
+    lines = _lines[:]
+    del _lines[:]
+    _flushScheduled = False
+
+  if lines:
+    with open(_path, "a") as traceFile:
+      traceFile.write("\n".join(lines) + "\n")
+
+
+def deltaEncode(selection):
+
+  # the endpoints of the regions as differences to the previous endpoint,
+  # which are mostly small numbers
+  deltas = []
+  last = 0
+  for region in selection:
+    deltas.append(region.a - last)
+    deltas.append(region.b - region.a)
+    last = region.b
+
+  return deltas
+
+
+def deltaDecode(deltas):
+
+  endpoints = []
+  last = 0
+  for delta in deltas:
+    last += delta
+    endpoints.append(last)
+
+  return endpoints
+
+
+def readTrace(path):
+
+  # the events of a trace as (milliseconds, view id, event, endpoints) tuples
+  with open(path) as traceFile:
+    for line in traceFile:
+      if not line.strip():
+        continue
+
+      entry = json.loads(line)
+      endpoints = deltaDecode(entry[3]) if len(entry) > 3 else None
+      yield entry[0], entry[1], entry[2], endpoints
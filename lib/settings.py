@@ -0,0 +1,53 @@
+import sublime
+
+
+# A snapshot of the MultiEditUtils settings. Every key is read once from the
+# settings object and the snapshot is dropped as soon as the settings change,
+# so that lookups on hot paths like on_query_context are dictionary reads.
+_settings = None
+_values = {}
+_listeners = []
+
+
+def get(key, default=None):
+
+  try:
+    value = _values[key]
+  except KeyError:
+    value = _values[key] = loadSettings().get(key)
+
+  return default if value is None else value
+
+
+def loadSettings():
+
+  global _settings
+  if _settings is None:
+    _settings = sublime.load_settings("MultiEditUtils.sublime-settings")
+    _settings.add_on_change("meu_settings", onSettingsChanged)
+
+  return _settings
+
+
+def onSettingsChanged():
+
+  _values.clear()
+  for listener in _listeners:
+    listener()
+
+
+def addListener(listener):
+
+  # listeners are called after the snapshot was dropped
+  if listener not in _listeners:
+    _listeners.append(listener)
+
+
+def unload():
+
+  global _settings
+  if _settings is not None:
+    _settings.clear_on_change("meu_settings")
+    _settings = None
+
+  _values.clear()
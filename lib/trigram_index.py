@@ -0,0 +1,306 @@
+import sublime
+import re
+import sys
+from array import array
+from bisect import bisect_right
+
+from . import settings
+from .region_array import RegionArray
+
+
+# An optional index of the trigrams of large views, so that MultiFindAllCommand
+# only has to search the parts of the buffer which can contain a needle. The
+# buffer is split into blocks and every trigram of the lowercased text maps to
+# a bitset of the blocks it begins in. Edits shift the blocks and reindex the
+# touched ones. Trigrams which were removed by an edit stay in the index, they
+# only add candidate blocks, which are verified against the text anyway.
+
+blockSize = 4096
+# edits touching more blocks are not applied incrementally, the index is
+# rebuilt instead
+maxUpdatedBlocks = 64
+
+# the indexes per view id, see get
+_indexes = {}
+# the ids of the views whose index is being built
+_building = set()
+# the view ids and sizes of views whose index exceeded the memory cap
+_tooLarge = {}
+# the view ids and change counts of views whose text can't be indexed
+_unindexable = {}
+
+
+class TrigramIndex:
+
+  def __init__(self, blockSize=blockSize):
+
+    self.blockSize = blockSize
+    self.blockStarts = array("q", [0])
+    self.size = 0
+    self.bits = {}
+    # the change count of the view, which the index reflects
+    self.changeCount = None
+    # the number of blocks which were reindexed since the index was built
+    self.updatedBlocks = 0
+    # the memory of the trigrams in the index, see memory
+    self.trigramMemory = 0
+
+
+  def build(self, text, maxMemory=None):
+
+    # Returns False if the text can't be indexed or if the index would take
+    # more than maxMemory bytes, which is checked after every block.
+
+    # lowercasing must not change the offsets, otherwise the text can't be indexed
+    lowered = text.lower()
+    if len(lowered) != len(text):
+      return False
+
+    self.size = len(text)
+    self.blockStarts = array("q", range(0, max(len(text), 1), self.blockSize))
+    self.bits = {}
+    self.updatedBlocks = 0
+    self.trigramMemory = 0
+
+    for block, start in enumerate(self.blockStarts):
+      self.indexBlock(block, lowered[start:start + self.blockSize + 2])
+      if maxMemory is not None and self.memory() > maxMemory:
+        return False
+
+    return True
+
+
+  def indexBlock(self, block, text):
+
+    # text is the lowercased block and the two characters after it, so that
+    # it contains every trigram which begins in the block
+    bit = 1 << block
+    bits = self.bits
+    for trigram in set(text[i:i + 3] for i in range(len(text) - 2)):
+      blocks = bits.get(trigram)
+      if blocks is None:
+        self.trigramMemory += sys.getsizeof(trigram)
+        bits[trigram] = bit
+      else:
+        bits[trigram] = blocks | bit
+
+
+  def blockEnd(self, block):
+
+    if block + 1 < len(self.blockStarts):
+      return self.blockStarts[block + 1]
+
+    return self.size
+
+
+  def minBlockLength(self):
+
+    starts = self.blockStarts
+    lengths = [starts[i + 1] - starts[i] for i in range(len(starts) - 1)]
+    return min(lengths) if lengths else self.size
+
+
+  def memory(self):
+
+    # An upper bound of the memory of the index, which is cheap enough to be
+    # checked while building it. No bitset is larger than one with the bit of
+    # the last block.
+    bits = self.bits
+    return (
+      sys.getsizeof(bits) +
+      self.trigramMemory +
+      len(bits) * sys.getsizeof(1 << len(self.blockStarts)) +
+      self.blockStarts.itemsize * len(self.blockStarts)
+    )
+
+
+  def findAll(self, view, needle, case):
+
+    # The matches of the needle as RegionArray like view.find_all with LITERAL
+    # or None, if the index can't be used for the needle. A match which begins
+    # in a block has all of its trigrams in this block or the next one, as long
+    # as the needle isn't longer than the blocks.
+    lowered = needle.lower()
+    if len(needle) < 3 or len(lowered) != len(needle) or len(needle) > self.minBlockLength():
+      return None
+
+    candidates = -1
+    for trigram in set(lowered[i:i + 3] for i in range(len(lowered) - 2)):
+      blocks = self.bits.get(trigram, 0)
+      candidates &= blocks | (blocks >> 1)
+      if not candidates:
+        return RegionArray()
+
+    pattern = re.compile(re.escape(needle), 0 if case else re.IGNORECASE)
+    matches = RegionArray()
+
+    # search every run of consecutive candidate blocks in one go
+    while candidates:
+      first = (candidates & -candidates).bit_length() - 1
+      shifted = candidates >> first
+      runLength = (~shifted & (shifted + 1)).bit_length() - 1
+      candidates &= ~(((1 << runLength) - 1) << first)
+
+      start = self.blockStarts[first]
+      end = self.blockEnd(first + runLength - 1)
+      text = view.substr(sublime.Region(start, min(end + len(needle) - 1, self.size)))
+
+      for match in pattern.finditer(text):
+        if match.start() >= end - start:
+          break
+        matches.append(start + match.start(), start + match.end())
+
+    return matches
+
+
+  def update(self, view, changes):
+
+    # Apply the changes, which are (a, b, text) tuples in the order of the
+    # edits. Every position refers to the buffer before its own edit, the view
+    # already contains all of them. Returns False if the index has to be
+    # rebuilt instead.
+    starts = self.blockStarts
+    dirty = []
+
+    for a, b, text in changes:
+      insertedEnd = a + len(text)
+      delta = len(text) - (b - a)
+
+      def shift(point):
+        if point <= a:
+          return point
+        if point < b:
+          return insertedEnd
+        return point + delta
+
+      for block in range(bisect_right(starts, a), len(starts)):
+        starts[block] = shift(starts[block])
+
+      dirty = [(shift(begin), shift(end)) for begin, end in dirty]
+      dirty.append((a, insertedEnd))
+      self.size += delta
+
+    # the trigrams which begin up to two characters before a change are affected
+    blocks = set()
+    for begin, end in dirty:
+      first = max(bisect_right(starts, begin - 2) - 1, 0)
+      last = max(bisect_right(starts, end) - 1, 0)
+      blocks.update(range(first, last + 1))
+
+    if len(blocks) > maxUpdatedBlocks:
+      return False
+
+    for block in blocks:
+      start, end = starts[block], self.blockEnd(block)
+      if block + 1 < len(starts) and end - start < self.blockSize // 4:
+        # the block shrank too much to find longer needles
+        return False
+
+      text = view.substr(sublime.Region(start, min(end + 2, self.size)))
+      lowered = text.lower()
+      if len(lowered) != len(text):
+        return False
+
+      self.indexBlock(block, lowered)
+
+    self.updatedBlocks += len(blocks)
+    return True
+
+
+
+def isEnabled(view):
+
+  return (
+    settings.get("find_all_index", False) and
+    view.size() >= settings.get("find_all_index_min_size", 1000000)
+  )
+
+
+def get(view):
+
+  # the index of the view, unless it is missing or stale
+  index = _indexes.get(view.id())
+  if index is None or index.changeCount != view.change_count() or not isEnabled(view):
+    return None
+
+  return index
+
+
+def scheduleBuild(view, delay=0):
+
+  viewID = view.id()
+  if viewID in _building or not isEnabled(view):
+    return
+
+  # a text which can't be indexed is only tried again after a modification
+  if _unindexable.get(viewID) == view.change_count():
+    return
+
+  # a view is only indexed again after it was too large, if its size changed a lot
+  tooLargeSize = _tooLarge.get(viewID)
+  if tooLargeSize is not None and abs(view.size() - tooLargeSize) < tooLargeSize // 2:
+    return
+
+  _building.add(viewID)
+  sublime.set_timeout_async(lambda: build(view), delay)
+
+
+def build(view):
+
+  # This runs in the async thread, the index is only installed if the view
+  # wasn't modified in the meantime.
+  try:
+    if not view.is_valid():
+      return
+
+    changeCount = view.change_count()
+    maxMemory = settings.get("find_all_index_max_memory", 64) * 1024 * 1024
+    index = TrigramIndex()
+
+    if not index.build(view.substr(sublime.Region(0, view.size())), maxMemory):
+      if index.memory() > maxMemory:
+        _tooLarge[view.id()] = view.size()
+      else:
+        _unindexable[view.id()] = changeCount
+      _indexes.pop(view.id(), None)
+      return
+
+    index.changeCount = changeCount
+    sublime.set_timeout(lambda: install(view, index), 0)
+  finally:
+    _building.discard(view.id())
+
+
+def install(view, index):
+
+  if view.is_valid() and view.change_count() == index.changeCount:
+    _indexes[view.id()] = index
+    _tooLarge.pop(view.id(), None)
+    _unindexable.pop(view.id(), None)
+  else:
+    scheduleBuild(view, 1000)
+
+
+def onTextChanged(view, changes):
+
+  index = _indexes.get(view.id())
+  if index is None:
+    return
+
+  if not index.update(view, changes):
+    _indexes.pop(view.id(), None)
+    scheduleBuild(view, 1000)
+    return
+
+  index.changeCount = view.change_count()
+
+  if index.updatedBlocks > len(index.blockStarts):
+    # too many trigrams may be outdated, the index is replaced once rebuilt
+    scheduleBuild(view, 1000)
+
+
+def forgetView(view):
+
+  _indexes.pop(view.id(), None)
+  _tooLarge.pop(view.id(), None)
+  _unindexable.pop(view.id(), None)
@@ -1,19 +1,28 @@
 import sublime
 import sublime_plugin
 
-_ST3 = sublime.version() >= "3000"
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+from . import lib
 
 # highlight pushed region options
-if _ST3:
-    _FLAGS = sublime.DRAW_EMPTY | sublime.DRAW_NO_FILL
-else:
-    _FLAGS = sublime.DRAW_EMPTY | sublime.DRAW_OUTLINED
+_FLAGS = sublime.DRAW_EMPTY | sublime.DRAW_NO_FILL
 
 
 def get_settings(key, default=None):
     """Get the setting specified by the key."""
-    settings = sublime.load_settings("MultiEditUtils.sublime-settings")
-    return settings.get(key, default)
+    return lib.load("settings").get(key, default)
+
+
+# the number of stored and added fields per view id, see _get_field_counts
+_field_counts = {}
+# the stored fields per view id, see _get_field_store
+_field_stores = {}
+# the highlighted part of the buffer per view id, see _highlight_fields
+_highlight_windows = {}
+# the ids of the views, whose highlight is polled, see _poll_highlight
+_polled_views = set()
 
 
 def _get_settings(key, default=None):
@@ -24,20 +33,169 @@ def _get_settings(key, default=None):
     return get_settings("selection_fields.{0}".format(key), default)
 
 
+class _FieldStore(object):
+    """
+    The stored fields of a view as RegionArray, sorted by their begin.
+    The begins are kept next to the fields, such that the next field can
+    be found with a binary search and the fields can be updated in place
+    instead of fetching and rebuilding them for every jump.
+    """
+    def __init__(self, regions, change_count):
+        self.regions = regions
+        self.begins = regions.begins()
+        self.change_count = change_count
+
+    def find(self, pt):
+        """Get the index of the first field, which begins behind pt."""
+        return bisect_right(self.begins, pt)
+
+    def insert(self, index, regions):
+        self.regions.a[index:index] = regions.a
+        self.regions.b[index:index] = regions.b
+        self.begins[index:index] = regions.begins()
+
+    def pop(self, index):
+        region = self.regions.region(index)
+        del self.regions.a[index]
+        del self.regions.b[index]
+        del self.begins[index]
+        return region
+
+
+def _get_field_store(view):
+    """
+    Get the stored fields of the view.
+    The cached store is only used as long as the buffer has not been
+    modified, because the view moves the regions on modifications.
+    """
+    store = _field_stores.get(view.id())
+    if (store is None or store.change_count != view.change_count() or
+            len(store.regions) != _get_field_counts(view)[0]):
+        RegionArray = lib.load("region_array").RegionArray
+        regions = _get_fields(view, added_fields=False)
+        store = _FieldStore(RegionArray.fromRegions(regions).sorted(),
+                            view.change_count())
+        _field_stores[view.id()] = store
+    return store
+
+
 def _set_fields(view, regions, added_fields=False):
-    """Set the fields as regions in the view."""
-    # push the fields to the view, kwargs for ST3 and pos args for ST2
+    """Set the fields given as RegionArray as regions in the view."""
     if not added_fields:
         reg_name = "meu_sf_stored_selections"
         scope_setting = "scope.fields"
     else:
         reg_name = "meu_sf_added_selections"
         scope_setting = "scope.added_fields"
-    scope = _get_settings(scope_setting, "comment")
-    if _ST3:
-        view.add_regions(reg_name, regions, scope=scope, flags=_FLAGS)
+    visible_only = _get_settings("highlight_visible_only", False)
+    # push the fields to the view
+    if visible_only:
+        # the view only tracks the fields, the visible ones are
+        # highlighted separately by _highlight_fields
+        view.add_regions(reg_name, regions.toRegions(), scope="",
+                         flags=sublime.HIDDEN)
     else:
-        view.add_regions(reg_name, regions, scope, _FLAGS)
+        scope = _get_settings(scope_setting, "comment")
+        view.add_regions(reg_name, regions.toRegions(), scope=scope,
+                         flags=_FLAGS)
+        view.erase_regions(reg_name + "_visible")
+    _get_field_counts(view)[1 if added_fields else 0] = len(regions)
+    if not added_fields:
+        store = _field_stores.get(view.id())
+        if store is None or store.regions is not regions:
+            # the view keeps the regions sorted, so does the store
+            store = _FieldStore(regions.sorted(), view.change_count())
+            _field_stores[view.id()] = store
+        store.change_count = view.change_count()
+    if visible_only:
+        _highlight_fields(view)
+
+
+def _highlight_fields(view):
+    """
+    Highlight the fields in and around the visible region of the view.
+    One screen above and below the visible region is highlighted as well,
+    such that scrolling doesn't reveal fields without highlight at once.
+    """
+    if not view.is_valid() or not _has_fields(view):
+        return
+    visible = view.visible_region()
+    margin = max(visible.size(), 1)
+    window = sublime.Region(max(visible.begin() - margin, 0),
+                            visible.end() + margin)
+
+    # the stored fields are sorted, a field which begins before the window
+    # may still reach into it
+    store = _get_field_store(view)
+    begin = max(bisect_left(store.begins, window.begin()) - 1, 0)
+    end = bisect_right(store.begins, window.end())
+    stored_regions = store.regions[begin:end].filter(
+        lambda a, b: max(a, b) >= window.begin()).toRegions()
+    added_regions = [reg for reg in view.get_regions("meu_sf_added_selections")
+                     if reg.end() >= window.begin() and
+                     reg.begin() <= window.end()]
+
+    for reg_name, regions, scope_setting in [
+            ("meu_sf_stored_selections", stored_regions, "scope.fields"),
+            ("meu_sf_added_selections", added_regions, "scope.added_fields")]:
+        scope = _get_settings(scope_setting, "comment")
+        view.add_regions(reg_name + "_visible", regions, scope=scope,
+                         flags=_FLAGS)
+    _highlight_windows[view.id()] = window
+    _poll_highlight(view)
+
+
+def _refresh_highlight(view):
+    """Highlight the fields again, if the view was scrolled away."""
+    window = _highlight_windows.get(view.id())
+    if window is None:
+        return False
+    visible = view.visible_region()
+    if not window.contains(visible.begin()) or \
+            not window.contains(visible.end()):
+        # the regions may only be changed in the main thread
+        sublime.set_timeout(lambda: _highlight_fields(view), 0)
+    return True
+
+
+def _poll_highlight(view):
+    """
+    Check periodically whether the highlight must be refreshed,
+    because there is no event if the view is scrolled.
+    """
+    if view.id() in _polled_views:
+        return
+
+    def poll():
+        window = view.window()
+        if (view.is_valid() and window and window.active_view() == view and
+                _refresh_highlight(view)):
+            sublime.set_timeout_async(poll, 100)
+        else:
+            _polled_views.discard(view.id())
+
+    _polled_views.add(view.id())
+    sublime.set_timeout_async(poll, 100)
+
+
+def _get_field_counts(view):
+    """
+    Get the number of stored and added fields of the view.
+    The counts are cached, such that the context queries don't need to
+    fetch the regions.
+    """
+    counts = _field_counts.get(view.id())
+    if counts is None:
+        # the regions may exist without counts, e.g. after a plugin reload
+        counts = [len(view.get_regions("meu_sf_stored_selections")),
+                  len(view.get_regions("meu_sf_added_selections"))]
+        _field_counts[view.id()] = counts
+    return counts
+
+
+def _has_fields(view, added_fields=True):
+    counts = _get_field_counts(view)
+    return bool(counts[0] or (added_fields and counts[1]))
 
 
 def _get_fields(view, added_fields=True):
@@ -49,20 +207,28 @@ def _get_fields(view, added_fields=True):
 
 def _erase_added_fields(view):
     view.erase_regions("meu_sf_added_selections")
+    view.erase_regions("meu_sf_added_selections_visible")
+    _get_field_counts(view)[1] = 0
 
 
 def _erase_fields(view):
     view.erase_regions("meu_sf_stored_selections")
     view.erase_regions("meu_sf_added_selections")
+    view.erase_regions("meu_sf_stored_selections_visible")
+    view.erase_regions("meu_sf_added_selections_visible")
     view.erase_status("meu_field_message")
+    _field_counts[view.id()] = [0, 0]
+    _field_stores.pop(view.id(), None)
+    _highlight_windows.pop(view.id(), None)
 
 
-def _change_selection(view, regions, pos):
+def _change_selection(view, store, pos):
     """Extract the next selection, push all other fields."""
     # save and remove the position in the regions
-    sel = regions[pos]
-    del regions[pos]
+    sel = store.pop(pos)
+    regions = store.regions
     # add the regions as fields to the view
+    _field_stores[view.id()] = store
     _set_fields(view, regions)
     # add a feedback to the statusbar
     if len(regions) >= 1:
@@ -90,31 +256,32 @@ def _execute_jump(view, jump_forward, only_other):
     Add the selection to the fields and move the selection to the
     next field.
     """
-    regions = _get_fields(view)
+    RegionArray = lib.load("region_array").RegionArray
+    if _get_field_counts(view)[1]:
+        # the added fields become stored fields with the jump
+        regions = RegionArray.fromRegions(_get_fields(view)).sorted()
+        store = _FieldStore(regions, view.change_count())
+    else:
+        store = _get_field_store(view)
+    sels = view.sel()
 
-    try:
+    if len(sels):
         # search for the first field, which is behind the last selection
-        end = max(sel.end() for sel in view.sel())
-        pos = next(i for i, sel in enumerate(regions) if sel.begin() > end)
-    except:
-        # if there is no remaining field move the position behind the regions
-        pos = len(regions)
-    # insert the selection into the region
+        pos = store.find(sels[-1].end())
+    else:
+        # if there is no selection move the position behind the regions
+        pos = len(store.regions)
+    # insert the selection into the fields
     if only_other:
         sel_count = 0
     else:
-        sel_count = len(view.sel())
-        if sel_count == 1:
-            # handle special case of one selection
-            regions.insert(pos, view.sel()[0])
-        else:
-            # put the selections into the regions array
-            regions = regions[:pos] + list(view.sel()) + regions[pos:]
+        sel_count = len(sels)
+        store.insert(pos, RegionArray.fromRegions(sels))
     # the forward jump must jump over all added selections
     delta = sel_count if jump_forward else -1
     # move the position to the next field
     pos = pos + delta
-    return regions, pos
+    return store, pos
 
 
 def _subtract_selection(pushed_regions, sel_regions):
@@ -148,6 +315,7 @@ _valid_modes = [
 ]
 
 
+@lib.instrument
 class SelectionFieldsCommand(sublime_plugin.TextCommand):
     def run(self, edit, mode="smart", jump_forward=True, only_other=False):
         if mode not in _valid_modes:
@@ -157,9 +325,10 @@ class SelectionFieldsCommand(sublime_plugin.TextCommand):
                 .format(mode, ", ".join(_valid_modes))
             )
             return
+        RegionArray = lib.load("region_array").RegionArray
         view = self.view
-        has_fields = bool(_get_fields(view))
-        has_only_added_fields = (not _get_fields(view, added_fields=False) and
+        has_fields = _has_fields(view)
+        has_only_added_fields = (not _has_fields(view, added_fields=False) and
                                  _get_settings("add_separated", True))
         do_push = {
             "pop": False,
@@ -172,19 +341,22 @@ class SelectionFieldsCommand(sublime_plugin.TextCommand):
         sel_regions = None
 
         if do_push:  # push or initial trigger with anything except pop
-            sels = list(view.sel())
-            border_pos = 0 if jump_forward else len(sels) - 1
-            sel_regions = _change_selection(view, sels, border_pos)
+            store = _FieldStore(RegionArray.fromRegions(view.sel()),
+                                view.change_count())
+            border_pos = 0 if jump_forward else len(store.regions) - 1
+            sel_regions = _change_selection(view, store, border_pos)
         elif mode == "subtract":  # subtract selections from the pushed fields
             sel_regions = list(view.sel())
             pushed_regions = _get_fields(view)
-            regions = list(_subtract_selection(pushed_regions, sel_regions))
+            regions = RegionArray.fromRegions(
+                _subtract_selection(pushed_regions, sel_regions))
             _erase_added_fields(view)
             _set_fields(view, regions, added_fields=has_only_added_fields)
         elif mode == "add":  # add selections to the pushed fields
             pushed_regions = _get_fields(view)
             sel_regions = list(view.sel())
-            _set_fields(view, sel_regions + pushed_regions,
+            _set_fields(view,
+                        RegionArray.fromRegions(sel_regions + pushed_regions),
                         added_fields=has_only_added_fields)
         elif mode == "remove":  # remove pushed fields
             pop_regions = _restore_selection(view, only_other)
@@ -196,15 +368,16 @@ class SelectionFieldsCommand(sublime_plugin.TextCommand):
             sel_regions = _restore_selection(view, only_other)
         else:  # smart or cycle
             # execute the jump
-            regions, pos = _execute_jump(view, jump_forward, only_other)
+            store, pos = _execute_jump(view, jump_forward, only_other)
+            field_count = len(store.regions)
             # if we are in the cycle mode force the position to be valid
             if mode == "cycle":
-                pos = pos % len(regions)
+                pos = pos % field_count
             # check whether it is a valid position
-            pos_valid = pos == pos % len(regions)
+            pos_valid = pos == pos % field_count
             if pos_valid:
                 # move the selection to the new field
-                sel_regions = _change_selection(view, regions, pos)
+                sel_regions = _change_selection(view, store, pos)
             else:
                 # if we reached the end restore the selection and
                 # remove the highlight regions
@@ -213,31 +386,33 @@ class SelectionFieldsCommand(sublime_plugin.TextCommand):
         # change to the result selections, if they exists
         if sel_regions:
             view.sel().clear()
-            if _ST3:
-                view.sel().add_all(sel_regions)
-            else:
-                for sel in sel_regions:
-                    view.sel().add(sel)
+            view.sel().add_all(sel_regions)
             view.show(sel_regions[0])
 
 
+# the context keys of the selection fields and how they are evaluated,
+# the *_enabled keys have the same name in the settings
+_context_handlers = {
+    # selection field is active if the regions are pushed to the view
+    "is_selection_field": lambda view: _has_fields(view, added_fields=False),
+    # also if added fields are pushed
+    "is_selection_field.added_fields": lambda view: _has_fields(view),
+    "selection_fields_tab_enabled":
+        lambda view: get_settings("selection_fields_tab_enabled", False),
+    "selection_fields_escape_enabled":
+        lambda view: get_settings("selection_fields_escape_enabled", False),
+}
+
+
+@lib.instrument
 class SelectionFieldsContext(sublime_plugin.EventListener):
     def on_query_context(self, view, key, operator, operand, match_all):
-        if key not in ["is_selection_field", "is_selection_field.added_fields",
-                       "selection_fields_tab_enabled",
-                       "selection_fields_escape_enabled"]:
+        # this is called for every context key of every keybinding
+        handler = _context_handlers.get(key)
+        if handler is None:
             return False
 
-        if key == "is_selection_field":
-            # selection field is active if the regions are pushed to the view
-            result = bool(_get_fields(view, added_fields=False))
-        elif key == "is_selection_field.added_fields":
-            # selection field is active if the regions are pushed to the view
-            # also if added fields are pushed
-            result = bool(_get_fields(view))
-        else:
-            # the *_enabled key has the same name in the settings
-            result = get_settings(key, False)
+        result = handler(view)
 
         if operator == sublime.OP_EQUAL:
             result = result == operand
@@ -247,10 +422,94 @@ class SelectionFieldsContext(sublime_plugin.EventListener):
             raise Exception("Invalid Operator '{0}'.".format(operator))
         return result
 
+    def on_close(self, view):
+        _field_counts.pop(view.id(), None)
+        _field_stores.pop(view.id(), None)
+        _highlight_windows.pop(view.id(), None)
+
+
+@lib.instrument
+class SelectionFieldsHighlight(sublime_plugin.EventListener):
+    def on_activated_async(self, view):
+        if view.id() in _highlight_windows:
+            _poll_highlight(view)
 
-# this context listener is necessary for ST2/3 compatibility, because
-# the popup has only been added in ST3 build 3080 and we want this
-# context to be disabled for the escape key
+    def on_modified_async(self, view):
+        _refresh_highlight(view)
+
+    def on_selection_modified_async(self, view):
+        _refresh_highlight(view)
+
+
+def _field_sections(view):
+    """
+    Get the fields of the view as sections for lib.persistence or None,
+    if there are no fields. The current field is the selection, it is
+    saved on its own to be selected again on restore.
+    """
+    stored_regions = view.get_regions("meu_sf_stored_selections")
+    added_regions = view.get_regions("meu_sf_added_selections")
+    if not stored_regions and not added_regions:
+        return None
+    current_regions = view.sel() if stored_regions else []
+    RegionArray = lib.load("region_array").RegionArray
+    return OrderedDict([
+        ("stored", [RegionArray.fromRegions(stored_regions)]),
+        ("added", [RegionArray.fromRegions(added_regions)]),
+        ("current", [RegionArray.fromRegions(current_regions)]),
+    ])
+
+
+def _save_fields(view, on_close=False):
+    """Save the fields of the view to be restored with the file."""
+    if not get_settings("persist_selections", False):
+        return
+    lib.load("persistence").save(
+        view, "fields", _field_sections(view), on_close)
+
+
+def _restore_fields(view, sections):
+    """Restore the loaded fields, unless the view got new fields."""
+    if _has_fields(view):
+        return
+    RegionArray = lib.load("region_array").RegionArray
+    regions = {}
+    for name in ["stored", "added", "current"]:
+        regions[name] = RegionArray()
+        for group in sections.get(name, []):
+            regions[name].extend(group)
+    if regions["stored"] and not regions["current"]:
+        # without a saved selection the first field becomes the current one
+        regions["current"] = regions["stored"][:1]
+        regions["stored"] = regions["stored"][1:]
+    if regions["stored"]:
+        _set_fields(view, regions["stored"])
+    if regions["added"]:
+        _set_fields(view, regions["added"], added_fields=True)
+    if regions["current"]:
+        view.sel().clear()
+        view.sel().add_all(regions["current"].toRegions())
+
+
+@lib.instrument
+class SelectionFieldsPersistence(sublime_plugin.EventListener):
+    def on_load_async(self, view):
+        if not get_settings("persist_selections", False):
+            return
+        lib.load("persistence").load(
+            view, "fields", lambda sections: _restore_fields(view, sections))
+
+    def on_pre_close(self, view):
+        _save_fields(view, on_close=True)
+
+    def on_post_save_async(self, view):
+        _save_fields(view)
+
+
+# this context listener is necessary, because the popup has only been
+# added in ST3 build 3080 and we want this context to be disabled for
+# the escape key
+@lib.instrument
 class MeuPopupVisibleProxyContext(sublime_plugin.EventListener):
     def on_query_context(self, view, key, operator, operand, match_all):
         if key != "meu_popup_visible_proxy":
@@ -269,3 +528,8 @@ class MeuPopupVisibleProxyContext(sublime_plugin.EventListener):
         else:
             raise Exception("Invalid Operator '{0}'.".format(operator))
         return result
+
+
+def plugin_loaded():
+    """Instrument the commands, if this plugin is reloaded on its own."""
+    lib.instrumentAll()
@@ -2,10 +2,59 @@
 
 import sublime
 from unittest import TestCase
+import os
 import re
+import shutil
+import tempfile
+
+from concurrent import futures
+from importlib import import_module
+
+MultiEditUtils = import_module(".MultiEditUtils", "MultiEditUtils")
+FindAll = import_module(".lib.find_all", "MultiEditUtils")
+Persistence = import_module(".lib.persistence", "MultiEditUtils")
+RegionArray = import_module(".lib.region_array", "MultiEditUtils").RegionArray
+Scheduler = import_module(".lib.scheduler", "MultiEditUtils")
+SelectionStats = import_module(".lib.selection_stats", "MultiEditUtils")
+SelectionTrace = import_module(".lib.selection_trace", "MultiEditUtils")
+TrigramIndexModule = import_module(".lib.trigram_index", "MultiEditUtils")
+TrigramIndex = TrigramIndexModule.TrigramIndex
 
 version = sublime.version()
 
+
+def regionArray(pairs):
+
+  return RegionArray.fromRegions(sublime.Region(a, b) for a, b in pairs)
+
+
+class ScrolledView:
+
+  # A view with a fixed visible region, which records the shown regions
+  # instead of scrolling.
+  def __init__(self, view, visibleRegion):
+
+    self.view = view
+    self.visibleRegion = visibleRegion
+    self.shownRegions = []
+
+
+  def __getattr__(self, name):
+
+    return getattr(self.view, name)
+
+
+  def visible_region(self):
+
+    return self.visibleRegion
+
+
+  def show(self, region, *args):
+
+    self.shownRegions.append((region.a, region.b))
+
+
+
 class TestMultiEditUtils(TestCase):
 
   def setUp(self):
@@ -118,6 +167,76 @@ class TestMultiEditUtils(TestCase):
     self.assertRegionEqual(selection[1], regions[1])
 
 
+  def testSelectionWasExpanded(self):
+
+    listener = MultiEditUtils.SelectionListener()
+    current = regionArray([(0, 5), (9, 6), (12, 12)])
+
+    self.assertTrue(listener.isSubsetOf(current, regionArray([(1, 3), (7, 8), (12, 12)])))
+    self.assertTrue(listener.isSubsetOf(current, regionArray([(5, 0), (6, 9)])))
+    self.assertFalse(listener.isSubsetOf(current, regionArray([(1, 3), (4, 7)])))
+    self.assertFalse(listener.isSubsetOf(current, regionArray([(11, 11)])))
+
+
+  def testHistoryPersistence(self):
+
+    self.view.run_command("insert", {"characters": "this is a test"})
+
+    listener = MultiEditUtils.SelectionListener()
+    helper = MultiEditUtils.Helper.getOrConstructHelperForView(self.view)
+    history = [regionArray([(0, 4), (5, 7)]), regionArray([(10, 14), (8, 9)])]
+    helper.lastSelections[:] = history
+    sections = listener.historySections(self.view)
+
+    directory = tempfile.mkdtemp()
+    try:
+      path = os.path.join(directory, "history")
+      Persistence.writeState(path, Persistence.contentHash(self.view), sections)
+      loaded = Persistence.readState(path, Persistence.contentHash(self.view))
+    finally:
+      shutil.rmtree(directory)
+
+    # the restored history comes before the selections made since the load
+    current = regionArray([(0, 1), (2, 3)])
+    helper.lastSelections[:] = [current]
+    listener.restoreHistory(self.view, loaded)
+    self.assertEqual(helper.lastSelections, history + [current])
+
+    helper.lastSelections[:] = []
+    self.assertIsNone(listener.historySections(self.view))
+
+
+  def testSelectionRegisters(self):
+
+    testString = "one two three four"
+    self.view.run_command("insert", {"characters": testString})
+    selection = self.view.sel()
+
+    self.selectRegions([[0, 3], [8, 13]])
+    self.view.run_command("selection_register", {"action": "save", "name": "a"})
+
+    self.selectRegions([[4, 7], [10, 18]])
+    self.view.run_command("selection_register", {"action": "union", "name": "a"})
+    self.assertEqual(len(selection), 3)
+    self.assertRegionsEqual(selection, [[0, 3], [4, 7], [8, 18]])
+
+    self.selectRegions([[4, 7], [10, 18]])
+    self.view.run_command("selection_register", {"action": "intersect", "name": "a"})
+    self.assertEqual(len(selection), 1)
+    self.assertRegionsEqual(selection, [[10, 13]])
+
+    self.selectRegions([[4, 7], [10, 18]])
+    self.view.run_command("selection_register", {"action": "subtract", "name": "a"})
+    self.assertEqual(len(selection), 2)
+    self.assertRegionsEqual(selection, [[4, 7], [13, 18]])
+
+    # the register follows edits in front of it
+    self.selectRegions([[0, 0]])
+    self.view.run_command("insert", {"characters": "zero "})
+    self.view.run_command("selection_register", {"action": "restore", "name": "a"})
+    self.assertRegionsEqual(selection, [[5, 8], [13, 18]])
+
+
   def testRemoveEmptyRegions(self):
 
     testString = "a\nb\n\nc"
@@ -136,6 +255,152 @@ class TestMultiEditUtils(TestCase):
       self.assertRegionEqual(actual, expected)
 
 
+  def testFilterRegions(self):
+
+    testString = "a1 bb ccc3\ndddd e5 ffffff"
+    self.view.run_command("insert", {"characters": testString})
+    regions = [(0, 2), (3, 5), (6, 10), (11, 15), (16, 18), (19, 25)]
+
+    def filterRegions(args):
+      self.selectRegions(regions)
+      self.view.run_command("filter_regions", args)
+      return [(region.a, region.b) for region in self.view.sel()]
+
+    self.assertEqual(filterRegions({"min_length": 3, "max_length": 4}), [(6, 10), (11, 15)])
+    self.assertEqual(filterRegions({"regex": r"\d$"}), [(0, 2), (6, 10), (16, 18)])
+    self.assertEqual(filterRegions({"regex": r"\d", "invert": True}), [(3, 5), (11, 15), (19, 25)])
+    self.assertEqual(filterRegions({"lines": [2, 2]}), [(11, 15), (16, 18), (19, 25)])
+    self.assertEqual(filterRegions({"every": 2, "offset": 1}), [(3, 5), (11, 15), (19, 25)])
+    self.assertEqual(filterRegions({"lines": [1, 1], "regex": "c"}), [(6, 10)])
+    # inverted, the regions are kept for which at least one predicate fails
+    self.assertEqual(
+      filterRegions({"regex": r"\d", "min_length": 3, "invert": True}),
+      [(0, 2), (3, 5), (11, 15), (16, 18), (19, 25)]
+    )
+    # the selection is kept for an invalid step
+    self.assertEqual(filterRegions({"every": 0}), regions)
+    # the selection is kept if no region would be left
+    self.assertEqual(filterRegions({"min_length": 10}), regions)
+
+
+  def testTransformSelection(self):
+
+    testString = "b, C, a, b"
+    regions = [(0, 1), (3, 4), (6, 7), (9, 10)]
+
+    def transform(command, args=None):
+      self.view.run_command("select_all")
+      self.view.run_command("insert", {"characters": testString})
+      self.selectRegions(regions)
+      self.view.run_command(command, args)
+      text = self.view.substr(sublime.Region(0, self.view.size()))
+      selected = [self.view.substr(region) for region in self.view.sel()]
+      return text, selected
+
+    self.assertEqual(transform("sort_selection"), ("C, a, b, b", ["C", "a", "b", "b"]))
+    self.assertEqual(transform("sort_selection", {"case_sensitive": False}), ("a, b, b, C", ["a", "b", "b", "C"]))
+    self.assertEqual(transform("reverse_selection"), ("b, a, C, b", ["b", "a", "C", "b"]))
+    self.assertEqual(transform("unique_selection"), ("b, C, a, ", ["b", "C", "a", ""]))
+    self.assertEqual(
+      transform("insert_sequence", {"start": 8, "step": 2, "format": "{0:02}"}),
+      ("08, 10, 12, 14", ["08", "10", "12", "14"])
+    )
+
+
+  def testSelectionStats(self):
+
+    text = "ab ab c\nabc"
+    regions = regionArray([(0, 2), (5, 3), (6, 7), (7, 7), (8, 11)])
+    stats = SelectionStats.collect(regions, text, 0, top=2)
+
+    self.assertEqual(stats["regions"], 5)
+    self.assertEqual(stats["empty"], 1)
+    self.assertEqual(stats["overlapping"], 0)
+    self.assertEqual(stats["total_length"], 8)
+    self.assertEqual((stats["min_length"], stats["median_length"], stats["max_length"]), (0, 2, 3))
+    self.assertEqual(stats["distinct_texts"], 4)
+    self.assertEqual(stats["top_texts"][0], ("ab", 2))
+    self.assertEqual(len(stats["top_texts"]), 2)
+
+    overlapping = regionArray([(0, 5), (2, 3), (4, 7)])
+    self.assertEqual(SelectionStats.collect(overlapping, text, 0)["overlapping"], 2)
+
+
+  def testSelectionStatsCommand(self):
+
+    window = self.view.window()
+    if not hasattr(window, "find_output_panel"):
+      self.skipTest("the output panels can't be found on this build")
+
+    self.view.run_command("insert", {"characters": "ab ab c\nabc"})
+    self.selectRegions([(0, 2), (8, 11)])
+    self.view.run_command("selection_stats")
+
+    panel = window.find_output_panel("selection_stats")
+    self.assertIsNotNone(panel)
+    report = panel.substr(sublime.Region(0, panel.size()))
+    self.assertIn("lines           1 - 2", report)
+
+
+  def testSelectionTraceEncoding(self):
+
+    regions = [sublime.Region(5, 8), sublime.Region(12, 10), sublime.Region(20, 20)]
+    deltas = SelectionTrace.deltaEncode(regions)
+
+    self.assertEqual(deltas, [5, 3, 4, -2, 10, 0])
+    self.assertEqual(SelectionTrace.deltaDecode(deltas), [5, 8, 12, 10, 20, 20])
+
+
+  def testMergeRegions(self):
+
+    self.view.run_command("insert", {"characters": "aaaa bbbb  cccc"})
+    self.selectRegions([(0, 4), (5, 9), (11, 15)])
+
+    self.view.run_command("merge_regions", {"tolerance": 1})
+    self.assertEqual(len(self.view.sel()), 2)
+    self.assertRegionsEqual(self.view.sel(), [(0, 9), (11, 15)])
+
+    self.view.run_command("merge_regions", {"tolerance": 2})
+    self.assertEqual(len(self.view.sel()), 1)
+    self.assertRegionsEqual(self.view.sel(), [(0, 15)])
+
+
+  def testCycleThroughRegions(self):
+
+    self.view.run_command("insert", {"characters": "a b c d e f"})
+    regions = [(0, 1), (2, 3), (4, 5), (6, 7), (8, 9), (10, 11)]
+    self.selectRegions(regions)
+
+    # the command is run directly on a view, which only shows the region (4, 5)
+    view = ScrolledView(self.view, sublime.Region(3, 5))
+    command = MultiEditUtils.CycleThroughRegionsCommand(view)
+
+    for args, expected in [
+      ({}, (6, 7)),
+      ({"step": 2}, (8, 9)),
+      ({"forward": False}, (2, 3)),
+      ({"forward": False, "step": 2}, (0, 1)),
+      # wrap around at the end and the beginning of the buffer
+      ({"step": 4}, (0, 1)),
+      ({"forward": False, "step": 3}, (10, 11)),
+    ]:
+      command.run(None, **args)
+      self.assertEqual(view.shownRegions[-1], expected, args)
+
+
+  def testSelectionEndpointsFollowTheSelection(self):
+
+    self.view.run_command("insert", {"characters": "a b c d e f"})
+    helper = MultiEditUtils.Helper()
+
+    self.selectRegions([(0, 1), (2, 3), (4, 5)])
+    self.assertEqual(list(helper.getSelectionEndpoints(self.view)), [(0, 1), (2, 3), (4, 5)])
+
+    # the cache is refreshed without a selection event and with the same number of regions
+    self.selectRegions([(0, 1), (6, 7), (10, 11)])
+    self.assertEqual(list(helper.getSelectionEndpoints(self.view)), [(0, 1), (6, 7), (10, 11)])
+
+
   def testStripSelection(self):
 
     testString = "  too much whitespace here  "
@@ -173,6 +438,21 @@ class TestMultiEditUtils(TestCase):
     self.assertRegionEqual(selection[0], [0, 0])
 
 
+  def testStripSelectionWithChars(self):
+
+    testString = '"quoted", "text"'
+
+    self.view.run_command("insert", {"characters": testString})
+    self.selectRegions([[0, 9], [10, 16]])
+    self.view.run_command("strip_selection", {"chars": '", '})
+
+    selection = self.view.sel()
+
+    self.assertEqual(len(selection), 2)
+    self.assertRegionEqual(selection[0], [1, 7])
+    self.assertRegionEqual(selection[1], [11, 15])
+
+
   def testMultiFindAll(self):
 
     testString = "abc def - abc - def - def"
@@ -193,6 +473,296 @@ class TestMultiEditUtils(TestCase):
     self.assertRegionsEqual(selection, expectedRegions)
 
 
+  def testMultiFindAllReusesCachedResults(self):
+
+    testString = "abc ABC Abc - abc"
+
+    self.view.run_command("insert", {"characters": testString})
+    selection = self.view.sel()
+
+    self.selectRegions([[0, 3]])
+    self.view.run_command("multi_find_all", {"case": False})
+    self.assertRegionsEqual(selection, [[0, 3], [4, 7], [8, 11], [14, 17]])
+
+    # the case sensitive matches are derived from the cached matches above
+    self.selectRegions([[0, 3]])
+    self.view.run_command("multi_find_all", {"case": True})
+    self.assertEqual(len(selection), 2)
+    self.assertRegionsEqual(selection, [[0, 3], [14, 17]])
+
+
+  def testMultiFindAllWithOverlappingNeedle(self):
+
+    testString = "Aaa aa"
+
+    self.view.run_command("insert", {"characters": testString})
+    selection = self.view.sel()
+
+    self.selectRegions([[4, 6]])
+    self.view.run_command("multi_find_all", {"case": False})
+    self.assertRegionsEqual(selection, [[0, 2], [4, 6]])
+
+    # the case insensitive match (0, 2) hides the case sensitive one at (1, 3)
+    self.selectRegions([[4, 6]])
+    self.view.run_command("multi_find_all", {"case": True})
+    self.assertEqual(len(selection), 2)
+    self.assertRegionsEqual(selection, [[1, 3], [4, 6]])
+
+
+  def testMultiFindAllViews(self):
+
+    window = self.view.window()
+    otherView = window.new_file()
+    changedView = window.new_file()
+    command = MultiEditUtils.MultiFindAllViewsCommand(window)
+    try:
+      self.view.run_command("insert", {"characters": "abc x abc"})
+      otherView.run_command("insert", {"characters": "abc abcabc"})
+      changedView.run_command("insert", {"characters": "abc"})
+
+      snapshots = command.searchViews([self.view, otherView, changedView], ["abc"], True, None, lambda snapshots: None)
+      # a view which is modified after its snapshot was taken is left out
+      changedView.run_command("insert", {"characters": " abc"})
+      futures.wait([snapshot.future for snapshot in snapshots])
+      command.onAllSearched(snapshots, False)
+      window.run_command("hide_overlay")
+
+      results = command.lastResults[window.id()]
+      self.assertEqual([result.view.id() for result in results], [self.view.id(), otherView.id()])
+      self.assertEqual(list(results[0].result), [(0, 3), (6, 9)])
+      self.assertEqual(list(results[1].result), [(0, 3), (4, 7), (7, 10)])
+      # the snapshots are released after the search
+      self.assertIsNone(results[0].text)
+
+      # choosing a file in the quick panel selects its matches
+      command.applyResult(results[1])
+      self.assertRegionsEqual(otherView.sel(), [(0, 3), (4, 7), (7, 10)])
+
+      # the results of a file are dropped when it is closed
+      command.forgetView(otherView)
+      self.assertEqual(len(command.lastResults[window.id()]), 1)
+      command.forgetView(self.view)
+      self.assertNotIn(window.id(), command.lastResults)
+    finally:
+      command.lastResults.pop(window.id(), None)
+      for view in [otherView, changedView]:
+        view.set_scratch(True)
+        window.focus_view(view)
+        window.run_command("close_file")
+
+
+  def testBufferViews(self):
+
+    window = self.view.window()
+    window.focus_view(self.view)
+    window.run_command("clone_file")
+    clone = window.active_view()
+    try:
+      self.assertEqual(clone.buffer_id(), self.view.buffer_id())
+
+      # the active clone stands in for the buffer
+      viewIDs = [view.id() for view in MultiEditUtils.bufferViews(window)]
+      self.assertIn(clone.id(), viewIDs)
+      self.assertNotIn(self.view.id(), viewIDs)
+
+      window.focus_view(self.view)
+      viewIDs = [view.id() for view in MultiEditUtils.bufferViews(window)]
+      self.assertIn(self.view.id(), viewIDs)
+      self.assertNotIn(clone.id(), viewIDs)
+    finally:
+      window.focus_view(clone)
+      window.run_command("close_file")
+
+
+  def testFindNeedlesInText(self):
+
+    text = "abc def - Abc - def - define"
+
+    matches = FindAll.findNeedlesInText(text, ["abc", "def"])
+    self.assertEqual(list(matches), [(0, 3), (4, 7), (16, 19), (22, 25)])
+
+    matches = FindAll.findNeedlesInText(text, ["abc"], case=False)
+    self.assertEqual(list(matches), [(0, 3), (10, 13)])
+
+    matches = FindAll.findNeedlesInText(text, ["def"], selectedWords={"def"})
+    self.assertEqual(list(matches), [(4, 7), (16, 19)])
+
+    # needles matching the same text are counted once
+    matches = FindAll.findNeedlesInText("abc ABC", ["abc", "ABC"], case=False)
+    self.assertEqual(list(matches), [(0, 3), (4, 7)])
+
+    # overlapping matches are merged, touching ones are kept apart
+    matches = FindAll.findNeedlesInText("foobar foofoo", ["foo", "foobar"])
+    self.assertEqual(list(matches), [(0, 6), (7, 10), (10, 13)])
+
+
+  def testRegionArray(self):
+
+    regions = regionArray([(10, 12), (5, 0), (3, 3), (3, 3), (11, 15), (15, 16)])
+
+    self.assertEqual(len(regions), 6)
+    self.assertEqual(regions[1], (5, 0))
+    self.assertEqual(list(regions[1:3]), [(5, 0), (3, 3)])
+    self.assertEqual(list(regions.sorted()), [(5, 0), (3, 3), (3, 3), (10, 12), (11, 15), (15, 16)])
+
+    merged = regions.merged()
+    self.assertEqual(list(merged), [(0, 5), (10, 15), (15, 16)])
+    self.assertEqual(list(regions.merged(tolerance=0)), [(0, 5), (10, 16)])
+
+    normalized = merged.normalized()
+    self.assertTrue(normalized.contains(4))
+    self.assertTrue(normalized.contains(11, 14))
+    self.assertFalse(normalized.contains(7))
+    self.assertFalse(normalized.contains(4, 11))
+
+    shifted = regions.map(lambda a, b: (a + 1, b + 1))
+    self.assertEqual(shifted.toRegions()[0], sublime.Region(11, 13))
+    self.assertEqual(RegionArray.fromRegions(regions.toRegions()), regions)
+
+
+  def testTrigramIndex(self):
+
+    view = self.view
+    view.run_command("insert", {"characters": "foo bar Foobar baz\n" * 8 + "qux FOO barbaz"})
+
+    def assertSameMatches(index):
+      for needle in ["foo", "Foo", "barbaz", "r baz", "qux", "missing"]:
+        for case in [True, False]:
+          flags = sublime.LITERAL if case else sublime.LITERAL | sublime.IGNORECASE
+          expected = [(region.a, region.b) for region in view.find_all(needle, flags)]
+          self.assertEqual(list(index.findAll(view, needle, case)), expected)
+
+    index = TrigramIndex(blockSize=16)
+    index.build(view.substr(sublime.Region(0, view.size())))
+    assertSameMatches(index)
+    # needles which are too short or longer than the blocks are not indexed
+    self.assertIsNone(index.findAll(view, "fo", True))
+    self.assertIsNone(index.findAll(view, "foo bar Foobar baz", True))
+
+    # insert a needle and remove another one
+    self.selectRegions([[40, 40]])
+    view.run_command("insert", {"characters": "quxqux"})
+    self.selectRegions([[4, 7]])
+    view.run_command("insert", {"characters": ""})
+    self.assertTrue(index.update(view, [(40, 40, "quxqux"), (4, 7, "")]))
+    assertSameMatches(index)
+
+
+  def runTask(self, generator):
+
+    # Run the generator with one progress step per slice. The test calls the
+    # following slices itself, the ones scheduled by the task don't run again.
+    self.addCleanup(setattr, Scheduler, "sliceDuration", Scheduler.sliceDuration)
+    Scheduler.sliceDuration = 0
+
+    results = []
+    task = Scheduler.run(self.view, "Test", generator, results.append)
+    return task, results
+
+
+  def countTo(self, count):
+
+    for index in range(count):
+      yield index / count
+
+    return count
+
+
+  def testSchedulerTimeSlicing(self):
+
+    task, results = self.runTask(self.countTo(3))
+
+    # the first slice runs right away
+    self.assertTrue(Scheduler.isRunning(self.view))
+    self.assertEqual(task.progress, 0)
+    self.assertIn("Test", self.view.get_status("meu_task"))
+
+    task.step()
+    task.step()
+    self.assertEqual(results, [])
+    task.step()
+    self.assertEqual(results, [3])
+    self.assertFalse(Scheduler.isRunning(self.view))
+    self.assertEqual(self.view.get_status("meu_task"), "")
+
+    # a finished task doesn't run again
+    task.step()
+    self.assertEqual(results, [3])
+
+
+  def testSchedulerCancel(self):
+
+    task, results = self.runTask(self.countTo(3))
+    self.assertTrue(Scheduler.cancel(self.view))
+    self.assertFalse(Scheduler.isRunning(self.view))
+    self.assertFalse(Scheduler.cancel(self.view))
+
+    task.step()
+    self.assertEqual(results, [])
+
+    # a new task of the view cancels the running one
+    task, results = self.runTask(self.countTo(3))
+    otherTask, otherResults = self.runTask(self.countTo(1))
+    self.assertTrue(task.cancelled)
+    otherTask.step()
+    self.assertEqual((results, otherResults), ([], [1]))
+
+
+  def testSchedulerAbortsOnModification(self):
+
+    task, results = self.runTask(self.countTo(3))
+    self.view.run_command("insert", {"characters": "modified"})
+
+    task.step()
+    self.assertTrue(task.cancelled)
+    self.assertFalse(Scheduler.isRunning(self.view))
+    self.assertEqual(results, [])
+
+
+  def testSchedulerError(self):
+
+    def failing():
+      yield 0
+      raise ValueError("failed")
+
+    task, results = self.runTask(failing())
+    self.assertRaises(ValueError, task.step)
+
+    # the task doesn't stay behind with its status
+    self.assertFalse(Scheduler.isRunning(self.view))
+    self.assertEqual(self.view.get_status("meu_task"), "")
+
+
+  def testTrigramIndexFailures(self):
+
+    text = "foo bar Foobar baz\n" * 8
+
+    # the memory is checked while the index is built
+    self.assertTrue(TrigramIndex(blockSize=16).build(text, 100000))
+    self.assertFalse(TrigramIndex(blockSize=16).build(text, 1000))
+
+    settings = sublime.load_settings("MultiEditUtils.sublime-settings")
+    oldSettings = [(key, settings.get(key)) for key in ["find_all_index", "find_all_index_min_size"]]
+    settings.set("find_all_index", True)
+    settings.set("find_all_index_min_size", 0)
+    try:
+      # lowercasing changes the length of the text, it can't be indexed
+      self.view.run_command("insert", {"characters": "\u0130" + text})
+      TrigramIndexModule.build(self.view)
+      self.assertIsNone(TrigramIndexModule.get(self.view))
+
+      # the failed build isn't repeated until the view is modified
+      TrigramIndexModule.scheduleBuild(self.view)
+      self.assertNotIn(self.view.id(), TrigramIndexModule._building)
+      self.view.run_command("insert", {"characters": "x"})
+      TrigramIndexModule.scheduleBuild(self.view)
+      self.assertIn(self.view.id(), TrigramIndexModule._building)
+    finally:
+      for key, value in oldSettings:
+        settings.set(key, value)
+      TrigramIndexModule.forgetView(self.view)
+
+
   def testDecode(self):
 
 
@@ -257,6 +827,62 @@ class TestMultiEditUtils(TestCase):
       self.assertEqual(self.view.substr(region), expectedString)
 
 
+  def testPreserveCaseWithMapping(self):
+
+    testString = "user users User USERS someUser user_name usersList superuser"
+    self.view.run_command("insert", {"characters": testString})
+
+    self.view.run_command("preserve_case", {"mapping": {"user": "account", "users": "accounts"}})
+
+    self.assertEqual(
+      self.view.substr(sublime.Region(0, self.view.size())),
+      "account accounts Account ACCOUNTS someAccount account_name accountsList superuser"
+    )
+
+
+  def testPreserveCasePreview(self):
+
+    if not hasattr(sublime, "PhantomSet"):
+      return
+
+    testString = "some_case someCase some_case"
+    self.view.run_command("insert", {"characters": testString})
+
+    command = MultiEditUtils.PreserveCaseCommand(self.view)
+    command.savedSelection = regionArray([(0, 9), (10, 18), (19, 28)])
+    command.showPreview("other case")
+
+    contents = [phantom.content for phantom in command.previewPhantoms.phantoms]
+    self.assertEqual(len(contents), 3)
+    self.assertIn("other_case", contents[0])
+    self.assertIn("otherCase", contents[1])
+    self.assertIn("other_case", contents[2])
+
+    command.erasePreview()
+    self.assertEqual(len(command.previewPhantoms.phantoms), 0)
+
+
+  def testPreserveCaseViews(self):
+
+    window = self.view.window()
+    otherView = window.new_file()
+    try:
+      self.view.run_command("insert", {"characters": "user User_name"})
+      otherView.run_command("insert", {"characters": "USER otherUsers"})
+
+      command = MultiEditUtils.PreserveCaseViewsCommand(window)
+      snapshots = command.planViews([self.view, otherView], {"user": "account"}, lambda snapshots: None)
+      futures.wait([snapshot.future for snapshot in snapshots])
+      command.onAllPlanned(snapshots)
+
+      self.assertEqual(self.view.substr(sublime.Region(0, self.view.size())), "account Account_name")
+      self.assertEqual(otherView.substr(sublime.Region(0, otherView.size())), "ACCOUNT otherUsers")
+    finally:
+      otherView.set_scratch(True)
+      window.focus_view(otherView)
+      window.run_command("close_file")
+
+
   def assertRegionEqual(self, a, b):
 
     self.assertEqual(a.a, b[0])
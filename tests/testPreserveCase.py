@@ -6,6 +6,7 @@ import os.path, sys
 from importlib import import_module
 
 MultiEditUtils = import_module(".MultiEditUtils", "MultiEditUtils")
+CaseAnalysis = import_module(".lib.case_analysis", "MultiEditUtils")
 
 class TestPreserveCase(TestCase):
 
@@ -32,7 +33,7 @@ class TestPreserveCase(TestCase):
 
     meta = self.cmd.analyzeString("a-BU-Cap-MiX")
 
-    Case = MultiEditUtils.Case
+    Case = CaseAnalysis.Case
 
     self.assertEqual(meta.separator, "-")
     self.assertListEqual(meta.cases, [Case.lower, Case.upper, Case.capitalized, Case.mixed])
@@ -73,3 +74,12 @@ class TestPreserveCase(TestCase):
     replacedString = self.cmd.replaceStringWithCase(oldString, newStringGroups)
 
     self.assertEqual(replacedString, "case-CASE-Case-Case")
+
+
+  def testPlanReplacements(self):
+
+    text = "some_identifier SomeIdentifier usingSomeIdentifier SOME-IDENTIFIER tiresome"
+    begins, ends, newStrings = CaseAnalysis.planReplacements(text, {"someIdentifier": "otherName"})
+
+    self.assertListEqual(list(zip(begins, ends)), [(0, 15), (16, 30), (36, 50), (51, 66)])
+    self.assertListEqual(newStrings, ["other_name", "OtherName", "OtherName", "OTHER-NAME"])
@@ -0,0 +1,214 @@
+import sublime, sublime_plugin
+from unittest import TestCase
+
+from importlib import import_module
+
+lib = import_module(".lib", "MultiEditUtils")
+profiling = import_module(".lib.profiling", "MultiEditUtils")
+
+
+@profiling.instrument
+class ProfiledCommand(sublime_plugin.TextCommand):
+
+  def run(self, edit, otherView=None):
+
+    self.view.substr(sublime.Region(0, 1))
+    self.view.substr(0)
+    self.view.sel().add(sublime.Region(0))
+    if otherView is not None:
+      otherView.substr(0)
+
+
+
+@profiling.instrument
+class ProfiledInputCommand(sublime_plugin.TextCommand):
+
+  # opens no input panel, the callback is called by the test
+  def run(self, edit):
+
+    self.onDone = profiling.follow(self.replace)
+
+
+  def replace(self, text):
+
+    self.replaced = text
+
+
+
+@profiling.instrument
+class ProfiledListener(sublime_plugin.EventListener):
+
+  def on_modified(self, view):
+
+    view.find_all("a", sublime.LITERAL)
+
+
+  def on_query_context(self, view, key, operator, operand, match_all):
+
+    return None
+
+
+
+@lib.instrument
+class RegisteredCommand(sublime_plugin.TextCommand):
+
+  def run(self, edit):
+
+    self.view.substr(0)
+
+
+
+class TestProfiling(TestCase):
+
+  def setUp(self):
+
+    self.view = sublime.active_window().new_file()
+    self.view.run_command("insert", {"characters": "abc"})
+
+    self.settings = sublime.load_settings("MultiEditUtils.sublime-settings")
+    self.wasEnabled = self.settings.get("profiling", False)
+    self.settings.set("profiling", True)
+    profiling.unload()
+    profiling.clear()
+
+
+  def tearDown(self):
+
+    self.settings.set("profiling", self.wasEnabled)
+    profiling.unload()
+    profiling.clear()
+
+    if self.view:
+      self.view.set_scratch(True)
+      self.view.window().run_command("close_file")
+
+
+  def events(self):
+
+    return [(event[0], dict(zip(profiling._counters, event[5]))) for event in profiling._events]
+
+
+  def testInstrumentedCommand(self):
+
+    otherView = sublime.active_window().new_file()
+    try:
+      command = ProfiledCommand(self.view)
+      command.run(None, otherView=otherView)
+    finally:
+      otherView.set_scratch(True)
+      sublime.active_window().focus_view(otherView)
+      sublime.active_window().run_command("close_file")
+
+    # the calls on other views are not counted
+    self.assertEqual(
+      self.events(),
+      [("ProfiledCommand.run", {"substr": 2, "find_all": 0, "sel_add": 1, "sel_add_all": 0})]
+    )
+    # the command gets its view back after the call
+    self.assertIs(command.view, self.view)
+
+
+  def testInstrumentedListener(self):
+
+    ProfiledListener().on_modified(self.view)
+    # api calls outside of instrumented calls are not counted
+    self.view.find_all("a", sublime.LITERAL)
+
+    self.assertEqual(
+      self.events(),
+      [("ProfiledListener.on_modified", {"substr": 0, "find_all": 1, "sel_add": 0, "sel_add_all": 0})]
+    )
+
+    # the context queries are not instrumented
+    ProfiledListener().on_query_context(self.view, "key", sublime.OP_EQUAL, True, False)
+    self.assertEqual(len(self.events()), 1)
+    self.assertFalse(hasattr(ProfiledListener.on_query_context, "__wrapped__"))
+
+
+  def testDisabled(self):
+
+    self.settings.set("profiling", False)
+    ProfiledCommand(self.view).run(None)
+    self.assertEqual(self.events(), [])
+
+    # the setting is read again after an unload, e.g. on a plugin reload
+    self.assertFalse(profiling.isEnabled())
+    profiling.unload()
+    self.assertIsNone(profiling._enabled)
+
+
+  def testInstrumentAll(self):
+
+    run = RegisteredCommand.__dict__["run"]
+    # the registered classes are instrumented once the profiling is enabled
+    lib.instrumentAll()
+    self.assertIs(RegisteredCommand.__dict__["run"].__wrapped__, run)
+
+    # instrumenting them again doesn't wrap the methods twice
+    lib.instrumentAll()
+    self.assertIs(RegisteredCommand.__dict__["run"].__wrapped__, run)
+
+    RegisteredCommand(self.view).run(None)
+    self.assertEqual([event[0] for event in self.events()], ["RegisteredCommand.run"])
+
+
+  def testPercentile(self):
+
+    values = list(range(1, 101))
+
+    self.assertEqual(profiling.percentile(values, 0.5), 50)
+    self.assertEqual(profiling.percentile(values, 0.95), 95)
+    self.assertEqual(profiling.percentile(values, 0.99), 99)
+    self.assertEqual(profiling.percentile([7], 0.99), 7)
+
+
+  def testSummarize(self):
+
+    # label, seconds, regions in and out, buffer size and the counted calls
+    profiling._events.extend([
+      ("a", 0.001, 1, 2, 10, (1, 0, 0, 0)),
+      ("b", 0.010, 5, 5, 20, (0, 0, 0, 0)),
+      ("a", 0.003, 3, 1, 30, (3, 0, 1, 0)),
+    ])
+    stats = profiling.summarize()
+
+    # sorted by the total time
+    self.assertEqual([stat["name"] for stat in stats], ["b", "a"])
+    stat = stats[1]
+    self.assertEqual(stat["count"], 2)
+    self.assertAlmostEqual(stat["total_ms"], 4)
+    self.assertAlmostEqual(stat["p50_ms"], 1)
+    self.assertAlmostEqual(stat["max_ms"], 3)
+    self.assertEqual((stat["regions_in"], stat["regions_out"], stat["buffer_size"]), (3, 2, 30))
+    # the api calls are the mean per call
+    self.assertEqual((stat["substr"], stat["sel_add"]), (2, 0.5))
+
+    self.assertIn("sel_add_all", profiling.formatStats(stats).splitlines()[0])
+
+
+  def testFollow(self):
+
+    written = []
+    writeProfile = profiling.writeProfile
+    profiling.writeProfile = lambda label, profile: written.append(label)
+    try:
+      # without a profiled call the callback is passed through
+      callback = lambda: None
+      self.assertIs(profiling.follow(callback), callback)
+
+      profiling.profileNextCommand()
+      command = ProfiledInputCommand(self.view)
+      command.run(None)
+      # the call only opened the input, the profile is taken of the callback
+      self.assertEqual(written, [])
+
+      command.onDone("text")
+      self.assertEqual(written, ["ProfiledInputCommand.run"])
+      self.assertEqual(command.replaced, "text")
+
+      # only the first call of the callback is profiled
+      command.onDone("other")
+      self.assertEqual(written, ["ProfiledInputCommand.run"])
+    finally:
+      profiling.writeProfile = writeProfile
+      profiling._profileNext = False
@@ -1,9 +1,16 @@
 # coding: utf8
 
 import sublime
+import os
+import shutil
+import tempfile
 from unittest import TestCase
 
-_ST3 = sublime.version() >= "3000"
+from importlib import import_module
+
+selection_fields = import_module(".selection_fields", "MultiEditUtils")
+persistence = import_module(".lib.persistence", "MultiEditUtils")
+
 version = sublime.version()
 
 
@@ -46,11 +53,7 @@ class TestSelectionFields(TestCase):
 
     def select_regions(self, regions):
         self.view.sel().clear()
-        if _ST3:
-            self.view.sel().add_all(map(to_region, regions))
-        else:
-            for region in regions:
-                self.view.sel().add(to_region(region))
+        self.view.sel().add_all(map(to_region, regions))
 
     def test_toggle(self):
         """Test whether the toggle works."""
@@ -180,3 +183,125 @@ class TestSelectionFields(TestCase):
         # add the added regions and sort it to retrieve the desired selections
         regions = list(map(to_region, result_regions_list))
         self.assertSelectionEqual(view.sel(), regions)
+
+    def test_context(self):
+        """Test whether the context keys follow the pushed fields."""
+        view = self.view
+        context = selection_fields.SelectionFieldsContext()
+
+        def query(key):
+            return context.on_query_context(view, key, sublime.OP_EQUAL,
+                                            True, False)
+
+        self.assertFalse(query("is_selection_field"))
+        self.assertFalse(query("unrelated_key"))
+
+        view.run_command("selection_fields", {"mode": "push"})
+        self.assertTrue(query("is_selection_field"))
+        self.assertTrue(query("is_selection_field.added_fields"))
+
+        view.run_command("selection_fields", {"mode": "pop"})
+        self.assertFalse(query("is_selection_field"))
+
+    def test_smart_edit(self):
+        """
+        Test whether the fields follow edits of the buffer during a run.
+        """
+        view = self.view
+        regions = list(self.start_regions)
+
+        view.run_command("selection_fields", {"mode": "smart"})
+        # replace the first field, which is selected, with a longer text
+        view.run_command("insert", {"characters": "xyz"})
+        regions[0] = to_region(regions[0].begin() + 3)
+        regions[1:] = [to_region((reg.a + 1, reg.b + 1))
+                       for reg in regions[1:]]
+
+        for region in regions[1:]:
+            view.run_command("selection_fields", {"mode": "smart"})
+            self.assertSelectionEqual(view.sel(), [region])
+        view.run_command("selection_fields", {"mode": "smart"})
+        self.assertSelectionEqual(view.sel(), regions)
+
+    def test_highlight_visible_only(self):
+        """
+        Test whether the jumps are unchanged if only the visible fields
+        are highlighted.
+        """
+        view = self.view
+        regions = list(self.start_regions)
+        settings = sublime.load_settings("MultiEditUtils.sublime-settings")
+        settings.set("selection_fields.highlight_visible_only", True)
+        try:
+            view.run_command("selection_fields", {"mode": "smart"})
+            stored_regions = view.get_regions("meu_sf_stored_selections")
+            self.assertSelectionEqual(regions[1:], stored_regions)
+            # the whole content is visible
+            visible_regions = view.get_regions(
+                "meu_sf_stored_selections_visible")
+            self.assertSelectionEqual(regions[1:], visible_regions)
+
+            for region in regions[1:]:
+                view.run_command("selection_fields", {"mode": "smart"})
+                self.assertSelectionEqual(view.sel(), [region])
+            view.run_command("selection_fields", {"mode": "smart"})
+            self.assertSelectionEqual(view.sel(), regions)
+            self.assertEqual(
+                view.get_regions("meu_sf_stored_selections_visible"), [])
+        finally:
+            settings.erase("selection_fields.highlight_visible_only")
+
+    def test_persistence_round_trip(self):
+        """
+        Test whether the saved fields are loaded again and dropped if the
+        content of the buffer changed.
+        """
+        view = self.view
+        view.run_command("selection_fields", {"mode": "smart"})
+        sections = selection_fields._field_sections(view)
+
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "fields")
+            digest = persistence.contentHash(view)
+            persistence.writeState(path, digest, sections)
+            # the hash is cached for closing the view
+            self.assertEqual(persistence.cachedHash(view), digest)
+
+            loaded = persistence.readState(path, persistence.contentHash(view))
+            self.assertEqual(list(loaded.keys()), list(sections.keys()))
+            for name in sections:
+                self.assertEqual([list(group) for group in loaded[name]],
+                                 [list(group) for group in sections[name]])
+
+            # a stale content hash drops the saved fields
+            view.run_command("insert", {"characters": "xyz"})
+            self.assertIsNone(persistence.cachedHash(view))
+            self.assertIsNone(
+                persistence.readState(path, persistence.contentHash(view)))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_restore(self):
+        """
+        Test whether restored fields continue where they were saved and
+        the selection isn't treated as another field.
+        """
+        view = self.view
+        regions = list(self.start_regions)
+
+        view.run_command("selection_fields", {"mode": "smart"})
+        sections = selection_fields._field_sections(view)
+        view.run_command("selection_fields", {"mode": "remove"})
+        self.select_regions([200])
+
+        selection_fields._restore_fields(view, sections)
+        self.assertSelectionEqual(view.sel(), regions[:1])
+        stored_regions = view.get_regions("meu_sf_stored_selections")
+        self.assertSelectionEqual(regions[1:], stored_regions)
+
+        for region in regions[1:]:
+            view.run_command("selection_fields", {"mode": "smart"})
+            self.assertSelectionEqual(view.sel(), [region])
+        view.run_command("selection_fields", {"mode": "smart"})
+        self.assertSelectionEqual(view.sel(), regions)